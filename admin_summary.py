@@ -0,0 +1,317 @@
+import os
+import json
+import sqlite3
+import getpass
+import argparse
+import threading
+from datetime import datetime
+
+import bcrypt
+
+from schema import init_db
+
+# 平台概览汇总：报告提交时由触发器记入 summary_pending，
+# 定时任务只处理新增的待汇总报告并累加到汇总表，概览页面只读汇总表，
+# 加载耗时与平台报告总量无关。
+# 每份计入汇总的报告在 summary_counted 中留有记录；报告撤回或删除（变更流 report_events 中的 deleted 事件）
+# 以及船舶删除时，按记录从汇总中减去；报告被修改（amended 事件）时先减去旧记录再重新记入待汇总，
+# 汇总始终与当前报告一致。
+DB_PATH = os.environ.get('SHIPTALK_DB', 'shipping_system.db')
+# 汇总表结构版本，与数据库中记录的不同时从头重建汇总
+SUMMARY_VERSION = '2'
+
+# 报告时间：优先使用提交时间，旧数据退回到创建时间
+_REPORT_TIME = "COALESCE(r.submitted_at, r.created_at)"
+
+_PENDING_REPORTS = '''
+    SELECT r.id, r.ship_id, r.report_type, r.created_at, r.submitted_at, s.company_id, s.ship_name
+    FROM summary_pending p
+    JOIN reports r ON r.id = p.report_id
+    JOIN ships s ON s.id = r.ship_id
+    WHERE p.report_id <= :bound AND r.status = 'submitted'
+'''
+
+
+def _get_state(c, key):
+    row = c.execute('SELECT value FROM summary_state WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else None
+
+
+def _set_state(c, key, value):
+    c.execute('INSERT OR REPLACE INTO summary_state (key, value) VALUES (?, ?)', (key, value))
+
+
+# 清空汇总表，把全部已提交报告重新记入待汇总
+def _rebuild(c):
+    for table in ('summary_companies', 'summary_daily', 'summary_vessels', 'summary_counted'):
+        c.execute(f'DELETE FROM {table}')
+    c.execute("INSERT OR IGNORE INTO summary_pending (report_id) SELECT id FROM reports WHERE status = 'submitted'")
+    c.execute("DELETE FROM summary_state WHERE key = 'initialized'")
+    _set_state(c, 'events_seq', c.execute('SELECT COALESCE(MAX(seq), 0) FROM report_events').fetchone()[0])
+    _set_state(c, 'version', SUMMARY_VERSION)
+
+
+# 从汇总中减去上次刷新后被撤回、删除、修改的报告以及已删除船舶的报告，返回减去的报告数
+# 被修改的报告重新记入 summary_pending，由随后的增量汇总按修改后的内容计入
+def _retract(c):
+    cursor = int(_get_state(c, 'events_seq') or 0)
+    last_seq = c.execute('SELECT COALESCE(MAX(seq), 0) FROM report_events').fetchone()[0]
+    report_ids = [row[0] for row in c.execute(
+        "SELECT report_id FROM report_events WHERE seq > ? AND seq <= ? AND event IN ('deleted', 'amended')",
+        (cursor, last_seq)
+    )]
+    c.execute('''
+        INSERT OR IGNORE INTO summary_pending (report_id)
+        SELECT report_id FROM report_events WHERE seq > ? AND seq <= ? AND event = 'amended'
+    ''', (cursor, last_seq))
+    _set_state(c, 'events_seq', last_seq)
+    # 已删除的船舶（与船队规模相关，与报告量无关）
+    ship_ids = [row[0] for row in c.execute(
+        'SELECT ship_id FROM summary_vessels WHERE ship_id NOT IN (SELECT id FROM ships)'
+    )]
+    if not report_ids and not ship_ids:
+        return 0
+
+    c.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS summary_retracted (
+            report_id INTEGER PRIMARY KEY, ship_id INTEGER, company_id INTEGER,
+            report_type TEXT, report_at TEXT, latency_seconds REAL
+        )
+    ''')
+    c.execute('DELETE FROM temp.summary_retracted')
+    c.execute('''
+        INSERT INTO temp.summary_retracted
+        SELECT * FROM summary_counted WHERE report_id IN (SELECT value FROM json_each(:reports))
+        UNION
+        SELECT * FROM summary_counted WHERE ship_id IN (SELECT value FROM json_each(:ships))
+    ''', {'reports': json.dumps(report_ids), 'ships': json.dumps(ship_ids)})
+    retracted = c.execute('SELECT COUNT(*) FROM temp.summary_retracted').fetchone()[0]
+
+    c.execute('''
+        UPDATE summary_companies SET
+            report_count = summary_companies.report_count - r.report_count,
+            latency_seconds = summary_companies.latency_seconds - r.latency_seconds,
+            latency_count = summary_companies.latency_count - r.latency_count
+        FROM (
+            SELECT company_id, COUNT(*) AS report_count,
+                   COALESCE(SUM(latency_seconds), 0) AS latency_seconds, COUNT(latency_seconds) AS latency_count
+            FROM temp.summary_retracted GROUP BY company_id
+        ) r
+        WHERE summary_companies.company_id = r.company_id
+    ''')
+    c.execute('''
+        UPDATE summary_daily SET report_count = summary_daily.report_count - r.report_count
+        FROM (
+            SELECT company_id, COALESCE(substr(report_at, 1, 10), '未知') AS day, COUNT(*) AS report_count
+            FROM temp.summary_retracted GROUP BY 1, 2
+        ) r
+        WHERE summary_daily.company_id = r.company_id AND summary_daily.day = r.day
+    ''')
+    c.execute('DELETE FROM summary_daily WHERE report_count <= 0')
+    c.execute('DELETE FROM summary_counted WHERE report_id IN (SELECT report_id FROM temp.summary_retracted)')
+
+    # 最近报告时间、每艘船最近一次报告按剩余的记录重新取
+    c.execute('''
+        UPDATE summary_companies SET last_report_at = (
+            SELECT MAX(report_at) FROM summary_counted WHERE company_id = summary_companies.company_id
+        )
+        WHERE company_id IN (SELECT company_id FROM temp.summary_retracted)
+    ''')
+    c.execute('''
+        UPDATE summary_vessels SET (last_report_type, last_report_at) = (
+            SELECT report_type, report_at FROM summary_counted WHERE ship_id = summary_vessels.ship_id
+            ORDER BY COALESCE(report_at, '') DESC, report_id DESC LIMIT 1
+        )
+        WHERE ship_id IN (SELECT ship_id FROM temp.summary_retracted)
+    ''')
+    c.execute('''
+        DELETE FROM summary_vessels
+        WHERE ship_id IN (SELECT value FROM json_each(:ships))
+           OR (ship_id IN (SELECT ship_id FROM temp.summary_retracted)
+               AND NOT EXISTS (SELECT 1 FROM summary_counted WHERE ship_id = summary_vessels.ship_id))
+    ''', {'ships': json.dumps(ship_ids)})
+    return retracted
+
+
+# 增量刷新汇总表，在写线程的事务中执行，返回本次计入和减去的报告数
+def refresh_summaries(c):
+    if _get_state(c, 'version') != SUMMARY_VERSION:
+        _rebuild(c)
+
+    # 船舶数量按公司重新统计（与船队规模相关，与报告量无关）
+    c.execute('''
+        INSERT INTO summary_companies (company_id, company_name, ship_count)
+        SELECT companies.id, companies.company_name, COUNT(ships.id)
+        FROM companies LEFT JOIN ships ON ships.company_id = companies.id
+        GROUP BY companies.id
+        ON CONFLICT (company_id) DO UPDATE SET
+            company_name = excluded.company_name,
+            ship_count = excluded.ship_count
+    ''')
+
+    retracted = _retract(c)
+
+    bound = c.execute('SELECT MAX(report_id) FROM summary_pending').fetchone()[0]
+    if bound is None:
+        _set_state(c, 'refreshed_at', datetime.now().isoformat(timespec='seconds'))
+        return retracted
+
+    c.execute(f'''
+        INSERT OR REPLACE INTO summary_counted (report_id, ship_id, company_id, report_type, report_at, latency_seconds)
+        SELECT id, ship_id, company_id, report_type, {_REPORT_TIME},
+               (julianday(submitted_at) - julianday(created_at)) * 86400
+        FROM ({_PENDING_REPORTS}) r
+    ''', {'bound': bound})
+    processed = c.rowcount
+
+    c.execute(f'''
+        INSERT INTO summary_companies (company_id, report_count, latency_seconds, latency_count, last_report_at)
+        SELECT company_id, COUNT(*),
+               COALESCE(SUM((julianday(submitted_at) - julianday(created_at)) * 86400), 0),
+               COUNT(julianday(submitted_at) - julianday(created_at)),
+               MAX({_REPORT_TIME})
+        FROM ({_PENDING_REPORTS}) r
+        GROUP BY company_id
+        ON CONFLICT (company_id) DO UPDATE SET
+            report_count = report_count + excluded.report_count,
+            latency_seconds = latency_seconds + excluded.latency_seconds,
+            latency_count = latency_count + excluded.latency_count,
+            last_report_at = NULLIF(MAX(COALESCE(last_report_at, ''), COALESCE(excluded.last_report_at, '')), '')
+    ''', {'bound': bound})
+
+    c.execute(f'''
+        INSERT INTO summary_daily (company_id, day, report_count)
+        SELECT company_id, COALESCE(substr({_REPORT_TIME}, 1, 10), '未知'), COUNT(*)
+        FROM ({_PENDING_REPORTS}) r
+        WHERE true
+        GROUP BY 1, 2
+        ON CONFLICT (company_id, day) DO UPDATE SET
+            report_count = report_count + excluded.report_count
+    ''', {'bound': bound})
+
+    # 每艘船最近一次报告（同一批次中取时间最晚、ID 最大的一份）
+    c.execute(f'''
+        INSERT INTO summary_vessels (ship_id, company_id, ship_name, last_report_type, last_report_at)
+        SELECT ship_id, company_id, ship_name, report_type, report_time FROM (
+            SELECT r.ship_id, r.company_id, r.ship_name, r.report_type, {_REPORT_TIME} AS report_time,
+                   ROW_NUMBER() OVER (PARTITION BY r.ship_id ORDER BY {_REPORT_TIME} DESC, r.id DESC) AS rn
+            FROM ({_PENDING_REPORTS}) r
+        )
+        WHERE rn = 1
+        ON CONFLICT (ship_id) DO UPDATE SET
+            ship_name = excluded.ship_name,
+            last_report_type = CASE WHEN COALESCE(excluded.last_report_at, '') >= COALESCE(last_report_at, '')
+                                    THEN excluded.last_report_type ELSE last_report_type END,
+            last_report_at = NULLIF(MAX(COALESCE(last_report_at, ''), COALESCE(excluded.last_report_at, '')), '')
+    ''', {'bound': bound})
+
+    c.execute('DELETE FROM summary_pending WHERE report_id <= ?', (bound,))
+    _set_state(c, 'refreshed_at', datetime.now().isoformat(timespec='seconds'))
+    return processed + retracted
+
+
+# 后台定时刷新汇总表
+class SummaryRefresher:
+    def __init__(self, writer, interval=60):
+        self.writer = writer
+        self.interval = interval
+        # 最近一次刷新失败的异常，刷新成功后清除，概览页面据此提示
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='summary-refresher', daemon=True)
+        self._thread.start()
+
+    def refresh(self):
+        try:
+            processed = self.writer.transaction(refresh_summaries).result()
+        except Exception as e:
+            self.last_error = e
+            raise
+        self.last_error = None
+        return processed
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                # 已记录在 last_error 中，下一轮继续
+                pass
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
+
+
+# 概览页面使用的查询，只读汇总表
+def load_overview(c, days=30):
+    companies = c.execute('''
+        SELECT company_name, ship_count, report_count,
+               CASE WHEN latency_count > 0 THEN latency_seconds / latency_count / 60 END,
+               last_report_at
+        FROM summary_companies ORDER BY company_name
+    ''').fetchall()
+    daily = c.execute('''
+        SELECT summary_daily.day, summary_companies.company_name, summary_daily.report_count
+        FROM summary_daily JOIN summary_companies ON summary_companies.company_id = summary_daily.company_id
+        WHERE summary_daily.day >= date('now', 'localtime', ?)
+        ORDER BY summary_daily.day
+    ''', (f'-{int(days)} days',)).fetchall()
+    vessels = c.execute('''
+        SELECT summary_companies.company_name, summary_vessels.ship_name,
+               summary_vessels.last_report_type, summary_vessels.last_report_at
+        FROM summary_vessels JOIN summary_companies ON summary_companies.company_id = summary_vessels.company_id
+        ORDER BY summary_vessels.last_report_at DESC
+        LIMIT 50
+    ''').fetchall()
+    refreshed_at = _get_state(c, 'refreshed_at')
+    return companies, daily, vessels, refreshed_at
+
+
+# 密码需包含字母、数字和符号，与网页注册的要求一致
+def _password_ok(password):
+    return (any(ch.isalpha() for ch in password) and any(ch.isdigit() for ch in password)
+            and any(ch in '!@#$%^&*()-+=' for ch in password))
+
+
+# 创建管理员账号。网页上不开放管理员注册，第一个管理员只能由能访问数据库的运维人员在命令行创建
+def create_admin(c, username, password):
+    hashed_pw = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+    c.execute('INSERT INTO admins (username, password) VALUES (?, ?)', (username, hashed_pw))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ShipTalk 平台管理')
+    parser.add_argument('--db', default=DB_PATH)
+    sub = parser.add_subparsers(dest='command', required=True)
+    create = sub.add_parser('create-admin', help='创建管理员账号')
+    create.add_argument('username')
+    sub.add_parser('refresh', help='立即刷新平台概览汇总')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, timeout=30)
+    try:
+        init_db(conn.cursor())
+        if args.command == 'create-admin':
+            # 非交互使用时可通过 SHIPTALK_ADMIN_PASSWORD 传入密码
+            password = os.environ.get('SHIPTALK_ADMIN_PASSWORD') or getpass.getpass('密码：')
+            if not _password_ok(password):
+                print('密码必须包含字母、数字和符号。')
+                return
+            try:
+                create_admin(conn.cursor(), args.username, password)
+            except sqlite3.IntegrityError:
+                print('用户名已存在。')
+                return
+            conn.commit()
+            print(f'管理员 {args.username} 已创建')
+        else:
+            processed = refresh_summaries(conn.cursor())
+            conn.commit()
+            print(f'汇总已刷新，处理 {processed} 份报告')
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
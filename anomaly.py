@@ -0,0 +1,204 @@
+import re
+import ast
+from collections import deque
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# 油耗、航速异常检测
+# 每艘船保留最近 WINDOW 份已提交报告的数值，用中位数/MAD 计算稳健 z 分数 0.6745 * (x - 中位数) / MAD；
+# 航速-油耗曲线按海军系数关系 油耗 ∝ 航速³ 处理，即检查 log(油耗) - 3·log(航速) 的偏离程度。
+FUEL_FIELD = '24小时耗油量'
+SPEED_FIELD = '平均航速'
+WINDOW = 30
+MIN_HISTORY = 5
+Z_THRESHOLD = 3.5
+
+# 物理上明显不合理的取值范围
+BOUNDS = {
+    FUEL_FIELD: (0, 300),   # 吨/天
+    SPEED_FIELD: (0, 35),   # 节
+}
+
+_NUMBER = re.compile(r'-?\d+(?:\.\d+)?')
+
+
+# 从自由文本中提取第一个数字，例如 "12.5节" -> 12.5
+def parse_number(text):
+    match = _NUMBER.search(str(text or ''))
+    return float(match.group()) if match else None
+
+
+def _speed_fuel_ratio(fuel, speed):
+    if fuel is None or speed is None or fuel <= 0 or speed <= 0:
+        return None
+    return np.log(fuel) - 3 * np.log(speed)
+
+
+# 单艘船的滚动统计，窗口大小固定，评分为常数时间
+# MAD 取各次观测值相对于当时滚动中位数的偏差的中位数，与批量重扫的算法一致
+class ShipStats:
+    def __init__(self):
+        self.windows = {}
+        self.deviations = {}
+        for key in (FUEL_FIELD, SPEED_FIELD, 'ratio'):
+            self.windows[key] = deque(maxlen=WINDOW)
+            self.deviations[key] = deque(maxlen=WINDOW)
+
+    def _append(self, key, value):
+        window = self.windows[key]
+        if len(window) >= MIN_HISTORY:
+            self.deviations[key].append(abs(value - np.median(window)))
+        window.append(value)
+
+    # 返回 (稳健 z 分数, 中位数)，历史不足时返回 None
+    def _z(self, key, value):
+        window = self.windows[key]
+        if len(window) < MIN_HISTORY or len(self.deviations[key]) < MIN_HISTORY:
+            return None
+        median = np.median(window)
+        mad = max(np.median(self.deviations[key]), 0.01 * abs(median), 1e-6)
+        return 0.6745 * (value - median) / mad, median
+
+    def observe(self, data):
+        fuel = parse_number(data.get(FUEL_FIELD))
+        speed = parse_number(data.get(SPEED_FIELD))
+        if fuel is not None:
+            self._append(FUEL_FIELD, fuel)
+        if speed is not None:
+            self._append(SPEED_FIELD, speed)
+        ratio = _speed_fuel_ratio(fuel, speed)
+        if ratio is not None:
+            self._append('ratio', ratio)
+
+    # 返回警告信息列表
+    def score(self, data):
+        warnings = []
+        values = {}
+        for field in (FUEL_FIELD, SPEED_FIELD):
+            if field not in data or data[field] == '':
+                continue
+            value = parse_number(data[field])
+            if value is None:
+                warnings.append(f'{field} "{data[field]}" 不是有效数字。')
+                continue
+            values[field] = value
+            low, high = BOUNDS[field]
+            if not low <= value <= high:
+                warnings.append(f'{field} {value:g} 超出合理范围 {low}~{high}。')
+                continue
+            scored = self._z(field, value)
+            if scored and abs(scored[0]) > Z_THRESHOLD:
+                warnings.append(f'{field} {value:g} 与该船近期数值（中位数 {scored[1]:g}）偏差过大。')
+
+        ratio = _speed_fuel_ratio(values.get(FUEL_FIELD), values.get(SPEED_FIELD))
+        scored = self._z('ratio', ratio) if ratio is not None else None
+        if scored and abs(scored[0]) > Z_THRESHOLD:
+            expected = np.exp(scored[1]) * values[SPEED_FIELD] ** 3
+            warnings.append(
+                f'航速 {values[SPEED_FIELD]:g} 节对应的油耗约为 {expected:.1f}，'
+                f'填报的 {values[FUEL_FIELD]:g} 与航速-油耗曲线不符。'
+            )
+        return warnings
+
+
+# 全部船舶的检测器，使用某艘船时从历史报告加载最近 WINDOW 份
+# 以该船在变更流（report_events）中的最新序号作为版本，报告提交、修改、撤回（包括其他进程写入的）后重新加载
+class AnomalyDetector:
+    def __init__(self):
+        self.ships = {}
+
+    def _stats(self, c, ship_id):
+        version = c.execute('SELECT MAX(seq) FROM report_events WHERE ship_id = ?', (ship_id,)).fetchone()[0]
+        cached = self.ships.get(ship_id)
+        if cached is None or cached[0] != version:
+            stats = ShipStats()
+            rows = c.execute(
+                '''SELECT data FROM reports WHERE ship_id = ? AND status = 'submitted'
+                   ORDER BY id DESC LIMIT ?''',
+                (ship_id, WINDOW)
+            ).fetchall()
+            for (data,) in reversed(rows):
+                try:
+                    stats.observe(ast.literal_eval(data))
+                except (ValueError, SyntaxError):
+                    continue
+            cached = self.ships[ship_id] = (version, stats)
+        return cached[1]
+
+    def score(self, c, ship_id, data):
+        return self._stats(c, ship_id).score(data)
+
+
+# 从报告文本（str(dict) 格式）中批量提取某字段的数值，data 为 pyarrow 字符串数组
+# 使用 pyarrow 的向量化正则，不逐行调用 Python
+def extract_field(data, field):
+    pattern = "'" + re.escape(field) + r"':\s*'[^'\d-]*(?P<value>-?\d+(?:\.\d+)?)"
+    matched = pc.struct_field(pc.extract_regex(data, pattern), 'value')
+    return pc.cast(matched, pa.float64()).to_numpy(zero_copy_only=False)
+
+
+# 按船分组的滚动中位数（仅使用每条记录之前的 WINDOW 条历史，与提交时的在线评分一致）
+# 数据已按船排序；在每组前插入 WINDOW 个空值，一次全局滚动即可保证窗口不跨船
+def _grouped_rolling_median(values, groups):
+    padded_pos = np.arange(len(values)) + WINDOW * (groups + 1)
+    padded = np.full(len(values) + WINDOW * (groups[-1] + 1 if len(groups) else 0), np.nan)
+    padded[padded_pos] = values
+    rolled = pd.Series(padded).rolling(WINDOW, min_periods=MIN_HISTORY).median().to_numpy()
+    return rolled[padded_pos - 1]
+
+
+def _rolling_z(values, groups):
+    median = _grouped_rolling_median(values, groups)
+    mad = _grouped_rolling_median(np.abs(values - median), groups)
+    mad = np.maximum(mad, np.maximum(0.01 * np.abs(median), 1e-6))
+    return 0.6745 * (values - median) / mad
+
+
+# 批量重扫历史报告，reports 需包含 id、ship_id、data 列
+# 返回每份报告的各项 z 分数以及是否异常
+def rescan(reports):
+    df = reports[['id', 'ship_id']].copy()
+    df = df.assign(data=reports['data'].astype(str)).sort_values(['ship_id', 'id'], kind='stable')
+    data = pa.array(df['data'], type=pa.string())
+    fuel = extract_field(data, FUEL_FIELD)
+    speed = extract_field(data, SPEED_FIELD)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where((fuel > 0) & (speed > 0), np.log(fuel) - 3 * np.log(speed), np.nan)
+
+    # 每艘船的组号（数据已按船排序）
+    ship_ids = df['ship_id'].to_numpy()
+    groups = np.concatenate(([0], np.cumsum(ship_ids[1:] != ship_ids[:-1])))
+
+    result = df[['id', 'ship_id']].copy()
+    result['fuel'] = fuel
+    result['speed'] = speed
+    with np.errstate(invalid='ignore'):
+        result['fuel_z'] = _rolling_z(fuel, groups)
+        result['speed_z'] = _rolling_z(speed, groups)
+        result['ratio_z'] = _rolling_z(ratio, groups)
+
+    out_of_bounds = np.zeros(len(df), dtype=bool)
+    for field, values in ((FUEL_FIELD, fuel), (SPEED_FIELD, speed)):
+        low, high = BOUNDS[field]
+        out_of_bounds |= ~np.isnan(values) & ((values < low) | (values > high))
+    z = result[['fuel_z', 'speed_z', 'ratio_z']].abs().to_numpy()
+    result['anomaly'] = out_of_bounds | (np.nan_to_num(z) > Z_THRESHOLD).any(axis=1)
+    return result
+
+
+# 重扫数据库中某公司（或全部公司）的已提交报告
+def rescan_fleet(conn, company_id=None):
+    query = '''
+        SELECT reports.id, reports.ship_id, reports.data
+        FROM reports JOIN ships ON reports.ship_id = ships.id
+        WHERE reports.status = 'submitted'
+    '''
+    params = ()
+    if company_id is not None:
+        query += ' AND ships.company_id = ?'
+        params = (company_id,)
+    reports = pd.read_sql_query(query, conn, params=params)
+    return rescan(reports)
@@ -0,0 +1,225 @@
+import os
+import json
+import base64
+import random
+import hashlib
+import sqlite3
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import bcrypt
+
+from db_writer import DBWriter
+from schema import init_db
+from ship_sync import decode_batch, apply_batch, BatchRejected, MAX_BODY_SIZE
+from change_feed import wait_for_events
+from geofence import load_zone_index, sync_history
+
+DB_PATH = os.environ.get('SHIPTALK_DB', 'shipping_system.db')
+
+# 供外部系统和船端使用的 HTTP 接口（与 Streamlit 界面独立运行）
+#   GET  /sync/reference  下载本公司船舶和报告模板
+#   POST /sync/batch      上传压缩报告批次，整批原子写入
+#   GET  /events?since=N&timeout=25  长轮询本公司报告变更事件（序号大于 N），无新事件时等待至超时
+#   GET  /events/stream?since=N      以 server-sent events 持续推送变更事件，断线后按 Last-Event-ID 续传
+class APIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, db_path=DB_PATH, drop_rate=0.0):
+        super().__init__(address, APIHandler)
+        self.db_path = db_path
+        # 模拟丢包的概率，用于测试重传和幂等性
+        self.drop_rate = drop_rate
+        self.writer = DBWriter(db_path)
+        self.writer.transaction(init_db).result()
+        # 排放控制区与港区索引，区域集合变化时先重算历史船位
+        self.zones = load_zone_index()
+        self.writer.transaction(lambda c: sync_history(c, self.zones)).result()
+        self._local = threading.local()
+        # 已验证的登录信息缓存，避免每个批次都做 bcrypt 校验；
+        # 以数据库中当前的密码哈希为键的一部分，修改密码后旧缓存自然失效，条目按最近最少使用淘汰
+        self._auth_cache = OrderedDict()
+        self._auth_lock = threading.Lock()
+        self.auth_cache_size = 1024
+        # 事件流空闲时发送保活注释的间隔（秒）
+        self.keepalive = 15
+
+    # 每个处理线程使用自己的只读连接
+    def reader(self):
+        if not hasattr(self._local, 'conn'):
+            self._local.conn = sqlite3.connect(self.db_path)
+        return self._local.conn
+
+    def authenticate(self, header):
+        if not header or not header.startswith('Basic '):
+            return None
+        try:
+            company_name, password = base64.b64decode(header[6:]).decode().split(':', 1)
+        except ValueError:
+            return None
+        result = self.reader().execute(
+            'SELECT id, password FROM companies WHERE company_name = ?', (company_name,)
+        ).fetchone()
+        if not result:
+            return None
+        cache_key = hashlib.sha256(f'{company_name}:{password}'.encode() + b'\0' + result[1]).hexdigest()
+        with self._auth_lock:
+            if cache_key in self._auth_cache:
+                self._auth_cache.move_to_end(cache_key)
+                return self._auth_cache[cache_key]
+        if not bcrypt.checkpw(password.encode(), result[1]):
+            return None
+        with self._auth_lock:
+            self._auth_cache[cache_key] = result[0]
+            while len(self._auth_cache) > self.auth_cache_size:
+                self._auth_cache.popitem(last=False)
+        return result[0]
+
+
+class APIHandler(BaseHTTPRequestHandler):
+    def _send_json(self, status, body):
+        raw = json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    # 按设定概率丢弃请求或响应
+    def _drop(self):
+        if random.random() < self.server.drop_rate:
+            self.close_connection = True
+            return True
+        return False
+
+    def _company_id(self):
+        company_id = self.server.authenticate(self.headers.get('Authorization'))
+        if company_id is None:
+            self._send_json(401, {'error': '认证失败'})
+        return company_id
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path not in ('/sync/reference', '/events', '/events/stream'):
+            self._send_json(404, {'error': '未找到'})
+            return
+        company_id = self._company_id()
+        if company_id is None:
+            return
+        query = parse_qs(url.query)
+        if url.path == '/events':
+            self._long_poll(company_id, query)
+        elif url.path == '/events/stream':
+            self._stream(company_id, query)
+        else:
+            self._reference(company_id)
+
+    def _since(self, query):
+        since = query.get('since', [self.headers.get('Last-Event-ID') or '0'])[0]
+        return int(since) if since.isdigit() else 0
+
+    def _long_poll(self, company_id, query):
+        timeout = query.get('timeout', ['25'])[0]
+        timeout = min(float(timeout), 60) if timeout.replace('.', '', 1).isdigit() else 25
+        since = self._since(query)
+        events = wait_for_events(self.server.reader(), company_id, since, timeout)
+        self._send_json(200, {
+            'events': events,
+            'last_seq': events[-1]['seq'] if events else since,
+        })
+
+    # server-sent events：每个事件的 id 为序号，空闲时定期发送注释行保持连接
+    def _stream(self, company_id, query):
+        since = self._since(query)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            while True:
+                events = wait_for_events(self.server.reader(), company_id, since, timeout=self.server.keepalive)
+                for event in events:
+                    self.wfile.write(
+                        f"id: {event['seq']}\nevent: {event['event']}\n"
+                        f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode()
+                    )
+                if events:
+                    since = events[-1]['seq']
+                else:
+                    self.wfile.write(b': keepalive\n\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+    def _reference(self, company_id):
+        reader = self.server.reader()
+        ships = reader.execute('SELECT id, ship_name FROM ships WHERE company_id = ?', (company_id,)).fetchall()
+        templates = reader.execute(
+            'SELECT id, report_type, fields FROM report_templates WHERE company_id = ?', (company_id,)
+        ).fetchall()
+        self._send_json(200, {
+            'ships': [{'id': s[0], 'ship_name': s[1]} for s in ships],
+            'templates': [{'id': t[0], 'report_type': t[1], 'fields': t[2]} for t in templates],
+        })
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        if path != '/sync/batch':
+            self._send_json(404, {'error': '未找到'})
+            return
+        company_id = self._company_id()
+        if company_id is None:
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            self._send_json(400, {'error': 'Content-Length 无效'})
+            return
+        if length > MAX_BODY_SIZE:
+            self._send_json(413, {'error': f'批次超过 {MAX_BODY_SIZE} 字节'})
+            return
+        payload = self.rfile.read(length)
+        # 模拟请求在途中丢失
+        if self._drop():
+            return
+        try:
+            reports = decode_batch(payload)
+        except ValueError as e:
+            self._send_json(400, {'error': f'批次解析失败：{e}'})
+            return
+        try:
+            accepted, duplicates = self.server.writer.transaction(
+                lambda c: apply_batch(c, company_id, reports, self.server.zones)
+            ).result()
+        except BatchRejected as e:
+            self._send_json(422, {'error': str(e), 'key': e.key.hex()})
+            return
+        except (ValueError, OverflowError, OSError) as e:
+            # 字段值超出范围（如创建时间）等，整批已回滚
+            self._send_json(400, {'error': f'批次内容无效：{e}'})
+            return
+        # 模拟确认在返回途中丢失：数据已入库，客户端重传时依靠幂等键去重
+        if self._drop():
+            return
+        self._send_json(200, {'accepted': accepted, 'duplicates': duplicates})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ShipTalk 接口服务')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8600)
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='模拟丢包概率（0~1）')
+    args = parser.parse_args()
+
+    server = APIServer((args.host, args.port), args.db, args.drop_rate)
+    print(f'接口服务已启动：http://{args.host}:{args.port}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+import os
+import sys
+import gzip
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import tempfile
+import threading
+from datetime import datetime
+
+# 在线备份：用 sqlite3 的在线备份接口复制数据库，写入压缩快照并记录校验和。
+# 应用内的定时备份在写线程中执行，每次只复制 PAGES_PER_STEP 页，两步之间提交排队的写请求；
+# 由同一连接写入的变更会同步到备份中，备份不会重新开始，前台写入最多等待一步的耗时。
+# 快照文件：<名称>.db.gz 为 gzip 压缩的数据库，<名称>.json 记录 SHA-256、页数和创建时间。
+DB_PATH = os.environ.get('SHIPTALK_DB', 'shipping_system.db')
+BACKUP_DIR = 'backups'
+PAGES_PER_STEP = 256
+# 其他连接写入会使备份从头开始，重新开始超过该次数时改为在独立连接上一次性复制
+MAX_RESTARTS = 3
+CHUNK_SIZE = 1024 * 1024
+
+
+class BackupRestarted(Exception):
+    pass
+
+
+# 用备份接口把 conn 复制到 dest_path，pages 为每步复制的页数（-1 表示一次复制全部）
+# pump 在每步之后调用，用于提交期间排队的写请求
+def copy_database(conn, dest_path, pages=PAGES_PER_STEP, pump=None):
+    state = {'remaining': None, 'restarts': 0}
+
+    def progress(status, remaining, total):
+        if state['remaining'] is not None and remaining > state['remaining']:
+            state['restarts'] += 1
+            if state['restarts'] > MAX_RESTARTS:
+                raise BackupRestarted(f'备份已重新开始 {state["restarts"]} 次')
+        state['remaining'] = remaining
+        if pump is not None:
+            pump()
+
+    dest = sqlite3.connect(dest_path)
+    # 临时文件随后会压缩并校验，无需日志和同步；缓存设小使页面逐步写出，
+    # 避免最后一步集中写盘阻塞写线程
+    dest.execute('PRAGMA journal_mode = OFF')
+    dest.execute('PRAGMA synchronous = OFF')
+    dest.execute('PRAGMA cache_size = -2048')
+    try:
+        conn.backup(dest, pages=pages, progress=progress)
+        page_count = dest.execute('PRAGMA page_count').fetchone()[0]
+    finally:
+        dest.close()
+    return page_count
+
+
+# 压缩快照并计算未压缩内容的 SHA-256
+def _compress(src_path, dest_path):
+    digest = hashlib.sha256()
+    size = 0
+    with open(src_path, 'rb') as src, gzip.open(dest_path, 'wb', compresslevel=6) as dest:
+        while True:
+            chunk = src.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+            dest.write(chunk)
+    return digest.hexdigest(), size
+
+
+def _snapshot_name(db_path):
+    base = os.path.splitext(os.path.basename(db_path))[0]
+    return f"{base}-{datetime.now().strftime('%Y%m%dT%H%M%S')}"
+
+
+# 生成一份快照。传入 writer（db_writer.DBWriter）时在写线程中分步复制，
+# 否则（命令行、应用未运行）在独立连接上一次性复制：WAL 模式下读事务不阻塞写入。
+def create_snapshot(db_path=DB_PATH, backup_dir=BACKUP_DIR, writer=None, pages=PAGES_PER_STEP, keep=None):
+    os.makedirs(backup_dir, exist_ok=True)
+    name = _snapshot_name(db_path)
+    raw_path = os.path.join(backup_dir, name + '.db.tmp')
+    started = time.monotonic()
+    try:
+        page_count = None
+        if writer is not None:
+            try:
+                page_count = writer.maintenance(
+                    lambda conn, pump: copy_database(conn, raw_path, pages, pump)
+                ).result()
+            except BackupRestarted:
+                # 其他进程持续写入时分步备份无法完成
+                os.remove(raw_path)
+        if page_count is None:
+            conn = sqlite3.connect(db_path)
+            try:
+                page_count = copy_database(conn, raw_path, pages=-1)
+            finally:
+                conn.close()
+        sha256, size = _compress(raw_path, os.path.join(backup_dir, name + '.db.gz'))
+    finally:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+
+    manifest = {
+        'source': os.path.abspath(db_path),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'sha256': sha256,
+        'size': size,
+        'page_count': page_count,
+        'seconds': round(time.monotonic() - started, 3),
+    }
+    with open(os.path.join(backup_dir, name + '.json'), 'w') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    if keep:
+        prune_snapshots(backup_dir, keep)
+    return name, manifest
+
+
+# 按创建时间列出快照 [(名称, 清单), ...]，最新的在前
+def list_snapshots(backup_dir=BACKUP_DIR):
+    snapshots = []
+    if not os.path.isdir(backup_dir):
+        return snapshots
+    for filename in os.listdir(backup_dir):
+        if filename.endswith('.json'):
+            name = filename[:-len('.json')]
+            with open(os.path.join(backup_dir, filename)) as f:
+                snapshots.append((name, json.load(f)))
+    snapshots.sort(key=lambda item: item[1]['created_at'], reverse=True)
+    return snapshots
+
+
+# 只保留最新的 keep 份快照
+def prune_snapshots(backup_dir, keep):
+    removed = []
+    for name, _ in list_snapshots(backup_dir)[keep:]:
+        for suffix in ('.db.gz', '.json'):
+            path = os.path.join(backup_dir, name + suffix)
+            if os.path.exists(path):
+                os.remove(path)
+        removed.append(name)
+    return removed
+
+
+# 解压快照到临时文件并校验 SHA-256 和数据库完整性，返回临时文件路径（调用方负责删除）
+def extract_snapshot(backup_dir, name):
+    with open(os.path.join(backup_dir, name + '.json')) as f:
+        manifest = json.load(f)
+    fd, raw_path = tempfile.mkstemp(suffix='.db')
+    digest = hashlib.sha256()
+    try:
+        with os.fdopen(fd, 'wb') as dest, gzip.open(os.path.join(backup_dir, name + '.db.gz'), 'rb') as src:
+            while True:
+                chunk = src.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                dest.write(chunk)
+        if digest.hexdigest() != manifest['sha256']:
+            raise ValueError(f'快照 {name} 校验和不一致')
+        conn = sqlite3.connect(raw_path)
+        try:
+            result = conn.execute('PRAGMA integrity_check').fetchone()[0]
+        finally:
+            conn.close()
+        if result != 'ok':
+            raise ValueError(f'快照 {name} 完整性检查失败：{result}')
+    except Exception:
+        os.remove(raw_path)
+        raise
+    return raw_path
+
+
+def verify_snapshot(backup_dir, name):
+    os.remove(extract_snapshot(backup_dir, name))
+
+
+# 校验后把快照恢复到 db_path。恢复同样使用备份接口写入目标库，
+# 在目标库上是一个写事务，其他连接只会看到恢复前或恢复后的完整内容
+def restore_snapshot(backup_dir, name, db_path=DB_PATH):
+    raw_path = extract_snapshot(backup_dir, name)
+    try:
+        src = sqlite3.connect(raw_path)
+        dest = sqlite3.connect(db_path, timeout=30)
+        try:
+            src.backup(dest)
+        finally:
+            src.close()
+            dest.close()
+    finally:
+        os.remove(raw_path)
+
+
+# 应用内定时备份
+class BackupScheduler:
+    def __init__(self, writer, backup_dir=BACKUP_DIR, interval=6 * 3600, keep=14):
+        self.writer = writer
+        self.backup_dir = backup_dir
+        self.interval = interval
+        self.keep = keep
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='backup-scheduler', daemon=True)
+        self._thread.start()
+
+    def _due(self):
+        snapshots = list_snapshots(self.backup_dir)
+        if not snapshots:
+            return True
+        last = datetime.fromisoformat(snapshots[0][1]['created_at'])
+        return (datetime.now() - last).total_seconds() >= self.interval
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self._due():
+                    create_snapshot(self.writer.db_path, self.backup_dir, writer=self.writer, keep=self.keep)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = e
+            self._stop.wait(min(self.interval, 600))
+
+    def stop(self):
+        self._stop.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ShipTalk 数据库备份')
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--dir', default=BACKUP_DIR, help='快照目录')
+    sub = parser.add_subparsers(dest='command', required=True)
+    snapshot = sub.add_parser('snapshot', help='立即生成一份快照')
+    snapshot.add_argument('--keep', type=int, default=14, help='保留的快照份数')
+    sub.add_parser('list', help='列出快照')
+    verify = sub.add_parser('verify', help='校验快照（默认最新一份）')
+    verify.add_argument('name', nargs='?')
+    restore = sub.add_parser('restore', help='校验并恢复快照（默认最新一份）')
+    restore.add_argument('name', nargs='?')
+    args = parser.parse_args()
+
+    if args.command == 'snapshot':
+        name, manifest = create_snapshot(args.db, args.dir, keep=args.keep)
+        print(f"已生成快照 {name}（{manifest['size']} 字节，用时 {manifest['seconds']} 秒）")
+        return
+
+    snapshots = list_snapshots(args.dir)
+    if args.command == 'list':
+        for name, manifest in snapshots:
+            print(f"{name}  {manifest['created_at']}  {manifest['size']} 字节  sha256={manifest['sha256'][:12]}")
+        return
+
+    name = args.name or (snapshots[0][0] if snapshots else None)
+    if name is None:
+        print('没有可用的快照。')
+        sys.exit(1)
+    try:
+        if args.command == 'verify':
+            verify_snapshot(args.dir, name)
+            print(f'快照 {name} 校验通过。')
+        else:
+            restore_snapshot(args.dir, name, args.db)
+            print(f'已从快照 {name} 恢复到 {args.db}。')
+    except (ValueError, OSError, sqlite3.Error) as e:
+        print(f'失败：{e}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import time
+
+# 报告变更日志的读取
+# report_events 由 reports 表上的触发器写入（见 schema.init_db），序号单调递增且只追加，
+# 客户端记住已读到的序号，每次只查询之后的新事件，刷新成本只与新增事件数有关。
+EVENT_COLUMNS = ['seq', 'event', 'report_id', 'ship_id', 'ship_name', 'report_type', 'data', 'created_at']
+
+
+def latest_seq(c, company_id):
+    return c.execute(
+        'SELECT COALESCE(MAX(seq), 0) FROM report_events WHERE company_id = ?', (company_id,)
+    ).fetchone()[0]
+
+
+# 读取某公司序号 since 之后的事件，按序号排列，最多 limit 条
+def read_events(c, company_id, since, limit=500):
+    rows = c.execute('''
+        SELECT report_events.seq, report_events.event, report_events.report_id, report_events.ship_id,
+               ships.ship_name, report_events.report_type, report_events.data, report_events.created_at
+        FROM report_events LEFT JOIN ships ON ships.id = report_events.ship_id
+        WHERE report_events.company_id = ? AND report_events.seq > ?
+        ORDER BY report_events.seq
+        LIMIT ?
+    ''', (company_id, since, limit)).fetchall()
+    return [dict(zip(EVENT_COLUMNS, row)) for row in rows]
+
+
+# 长轮询：等待新事件，最多等待 timeout 秒，超时返回空列表
+# 数据库未被其他连接修改时（PRAGMA data_version 不变）不重复查询
+def wait_for_events(conn, company_id, since, timeout=25, interval=0.5, limit=500):
+    deadline = time.monotonic() + timeout
+    version = None
+    while True:
+        current = conn.execute('PRAGMA data_version').fetchone()[0]
+        if current != version:
+            version = current
+            events = read_events(conn, company_id, since, limit)
+            if events:
+                return events
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return []
+        time.sleep(min(interval, remaining))
+
+
+# 把事件应用到按报告ID索引的报告集合，reports 的值为 (ID, 船舶ID, 船舶名称, 报告类型, 数据)
+def apply_events(reports, events):
+    for event in events:
+        if event['event'] == 'deleted':
+            reports.pop(event['report_id'], None)
+        else:
+            reports[event['report_id']] = (
+                event['report_id'], event['ship_id'], event['ship_name'], event['report_type'], event['data']
+            )
+    return reports
@@ -0,0 +1,205 @@
+import sqlite3
+import threading
+import queue
+import atexit
+from collections import namedtuple
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+# 单条写操作的结果
+WriteResult = namedtuple('WriteResult', ['lastrowid', 'rowcount'])
+
+# 队列中的停止标记
+_STOP = object()
+
+
+# 写请求的 Future：result() 默认最多等待 timeout 秒，避免写线程异常时调用方无限期阻塞；
+# 超时时请求若仍在排队则被取消，不会再执行
+class _WriteFuture(Future):
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def result(self, timeout=None):
+        try:
+            return super().result(self.timeout if timeout is None else timeout)
+        except FutureTimeoutError:
+            self.cancel()
+            raise
+
+
+# 维护任务（如在线备份），在写线程中执行但不包在写事务中
+class _Maintenance:
+    def __init__(self, fn):
+        self.fn = fn
+
+
+# 单写线程：所有写请求进入队列，由专用线程批量合并到同一事务中提交（group commit）
+class DBWriter:
+    def __init__(self, db_path, max_batch=256, busy_timeout=5000, timeout=60):
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self.busy_timeout = busy_timeout
+        # 调用方等待写请求结果的默认超时（秒）
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        # 统计信息：已提交事务数、已执行写请求数、失败请求数
+        self.stats = {'transactions': 0, 'requests': 0, 'errors': 0}
+        self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # 提交一个 SQL 写请求，返回 Future，结果为 WriteResult
+    def execute(self, sql, params=()):
+        def op(cur):
+            cur.execute(sql, params)
+            return WriteResult(cur.lastrowid, cur.rowcount)
+        return self.transaction(op)
+
+    # 批量执行同一 SQL
+    def executemany(self, sql, seq_of_params):
+        def op(cur):
+            cur.executemany(sql, seq_of_params)
+            return WriteResult(cur.lastrowid, cur.rowcount)
+        return self.transaction(op)
+
+    # 提交一个函数 fn(cursor)，在写线程的事务中执行，多条语句要么全部生效要么全部回滚
+    def transaction(self, fn):
+        future = _WriteFuture(self.timeout)
+        self._queue.put((fn, future))
+        return future
+
+    # 提交一个维护任务 fn(conn, pump)，在写线程中、两个写事务之间执行，返回 Future。
+    # 任务执行期间应定期调用 pump()，把期间排队的写请求作为一个事务提交，
+    # 这样长时间的任务被切成小段，前台写入的等待时间不超过一段的耗时
+    def maintenance(self, fn):
+        future = Future()
+        self._queue.put((_Maintenance(fn), future))
+        return future
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout)}')
+        # WAL 模式下读者不阻塞写者，写者也不阻塞读者
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+
+    def _run(self):
+        conn = self._connect()
+        cur = conn.cursor()
+        # 维护任务执行期间取到、需要在任务结束后再处理的停止标记或维护任务
+        self._deferred = []
+        stopping = False
+        while not stopping:
+            item = self._deferred.pop(0) if self._deferred else self._queue.get()
+            if item is _STOP:
+                break
+            if isinstance(item[0], _Maintenance):
+                self._run_maintenance(conn, cur, item)
+                continue
+            batch = [item]
+            # 取出队列中所有已经等待的请求，合并为一个事务
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                if isinstance(item[0], _Maintenance):
+                    self._deferred.append(item)
+                    break
+                batch.append(item)
+            self._commit_safely(conn, cur, batch)
+        conn.close()
+
+    def _run_maintenance(self, conn, cur, item):
+        task, future = item
+        if not future.set_running_or_notify_cancel():
+            return
+
+        def pump():
+            batch = []
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP or isinstance(item[0], _Maintenance):
+                    self._deferred.append(item)
+                    break
+                batch.append(item)
+            if batch:
+                self._commit_safely(conn, cur, batch)
+
+        try:
+            result = task.fn(conn, pump)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    # 提交一批写请求；任何意外异常（如 ROLLBACK TO 失败）都回滚整个事务，
+    # 并让本批次中尚未完成的请求以该异常结束，写线程继续处理后续请求
+    def _commit_safely(self, conn, cur, batch):
+        try:
+            self._commit_batch(conn, cur, batch)
+        except Exception as e:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                pass
+            failed = 0
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+                    failed += 1
+            self.stats['errors'] += failed
+
+    def _commit_batch(self, conn, cur, batch):
+        done = []
+        try:
+            cur.execute('BEGIN IMMEDIATE')
+        except sqlite3.Error as e:
+            for _, future in batch:
+                future.set_exception(e)
+            self.stats['errors'] += len(batch)
+            return
+
+        for fn, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            # 每个请求使用独立的保存点，单个请求失败不影响同批次的其他请求
+            cur.execute('SAVEPOINT write_request')
+            try:
+                result = fn(cur)
+            except Exception as e:
+                cur.execute('ROLLBACK TO write_request')
+                cur.execute('RELEASE write_request')
+                future.set_exception(e)
+                self.stats['errors'] += 1
+            else:
+                cur.execute('RELEASE write_request')
+                done.append((future, result))
+
+        try:
+            cur.execute('COMMIT')
+        except sqlite3.Error as e:
+            conn.rollback()
+            for future, _ in done:
+                future.set_exception(e)
+            self.stats['errors'] += len(done)
+            return
+
+        self.stats['transactions'] += 1
+        self.stats['requests'] += len(done)
+        # 事务提交后再通知调用方，保证返回时数据已落盘
+        for future, result in done:
+            future.set_result(result)
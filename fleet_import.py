@@ -0,0 +1,106 @@
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+# 批量导入船队（CSV / XLSX）
+# 整个文件一次性向量化校验：IMO 编号校验位、MMSI 格式、文件内重复以及与本公司已有船舶重复，
+# 全部通过后在写线程的一个事务中插入；有任何错误则一条都不写入，并返回逐行的错误说明。
+COLUMNS = ['船舶名称', 'IMO编号', 'MMSI']
+
+# 常见的英文表头
+COLUMN_ALIASES = {
+    'ship_name': '船舶名称', 'name': '船舶名称', 'vessel': '船舶名称', 'vessel_name': '船舶名称',
+    'imo': 'IMO编号', 'imo_number': 'IMO编号', 'imo_no': 'IMO编号',
+    'mmsi': 'MMSI',
+}
+
+
+# 读取上传的文件，返回只含 COLUMNS 三列的字符串 DataFrame
+def read_fleet_file(file, filename):
+    if os.path.splitext(filename)[1].lower() == '.xlsx':
+        try:
+            df = pd.read_excel(file, dtype=str)
+        except (zipfile.BadZipFile, KeyError, ValueError) as e:
+            raise ValueError('不是有效的 Excel（.xlsx）文件，文件可能已损坏') from e
+    else:
+        # 中文版 Excel 另存的 CSV 为 GBK 编码，UTF-8 解码失败时按 GBK 重读
+        try:
+            df = pd.read_csv(file, dtype=str, encoding='utf-8-sig')
+        except UnicodeDecodeError:
+            file.seek(0)
+            try:
+                df = pd.read_csv(file, dtype=str, encoding='gbk')
+            except UnicodeDecodeError as e:
+                raise ValueError('无法识别文件编码，请另存为 UTF-8 或 GBK 编码的 CSV 文件') from e
+    df = df.rename(columns=lambda name: COLUMN_ALIASES.get(str(name).strip().lower(), str(name).strip()))
+    missing = [column for column in COLUMNS if column not in df.columns]
+    if missing:
+        raise ValueError(f"文件缺少列：{'、'.join(missing)}")
+    df = df[COLUMNS].fillna('')
+    for column in COLUMNS:
+        df[column] = df[column].str.strip()
+    # 全角数字、字母（中文输入法下常见）转为半角，保证与已有船舶比较和唯一索引按同一写法
+    df['IMO编号'] = df['IMO编号'].str.normalize('NFKC').str.upper().str.replace(r'^IMO\s*', '', regex=True)
+    df['MMSI'] = df['MMSI'].str.normalize('NFKC').str.replace(r'\s+', '', regex=True)
+    # 整行为空的视为空行
+    return df[(df[COLUMNS] != '').any(axis=1)].reset_index(drop=True)
+
+
+# IMO 编号：7 位数字，前 6 位依次乘以 7、6、5、4、3、2 求和，个位数等于第 7 位
+def imo_valid(imo):
+    valid = imo.str.fullmatch(r'[0-9]{7}').to_numpy(dtype=bool)
+    if valid.any():
+        digits = imo[valid].to_numpy().astype('U7').view('U1').reshape(-1, 7).astype(np.int64)
+        check = digits[:, :6] @ np.arange(7, 1, -1) % 10
+        valid[valid] = check == digits[:, 6]
+    return valid
+
+
+# MMSI：9 位数字，船舶电台的前 3 位为海上识别码（MID），范围 201~775
+def mmsi_valid(mmsi):
+    valid = mmsi.str.fullmatch(r'[0-9]{9}').to_numpy(dtype=bool)
+    if valid.any():
+        mid = mmsi[valid].str[:3].astype(np.int64).to_numpy()
+        valid[valid] = (mid >= 201) & (mid <= 775)
+    return valid
+
+
+# 校验导入数据，existing 为本公司已有船舶 [(ship_name, imo_number, mmsi), ...]
+# 返回每行的错误说明列表（无错误为空列表），与 df 行对齐
+def validate_fleet(df, existing):
+    errors = [[] for _ in range(len(df))]
+
+    def flag(mask, message):
+        for i in np.flatnonzero(mask):
+            errors[i].append(message)
+
+    existing = pd.DataFrame(existing, columns=COLUMNS)
+    flag(df['船舶名称'] == '', '船舶名称为空')
+    flag(~imo_valid(df['IMO编号']), 'IMO编号无效（应为7位数字且校验位正确）')
+    flag(~mmsi_valid(df['MMSI']), 'MMSI无效（应为9位数字，前3位为201~775）')
+    for column in COLUMNS:
+        filled = df[column] != ''
+        flag(filled & df[column].duplicated(keep=False), f'{column}在文件中重复')
+        flag(filled & df[column].isin(existing[column]), f'{column}与已有船舶重复')
+    return errors
+
+
+# 已有船舶中 IMO 编号或 MMSI 重复的船舶（唯一索引建立之前录入的旧数据），ships 为 (ID, 船舶名称, IMO编号, MMSI)
+def duplicate_ships(ships):
+    df = pd.DataFrame(ships, columns=['ID'] + COLUMNS)
+    duplicated = np.zeros(len(df), dtype=bool)
+    for column in ('IMO编号', 'MMSI'):
+        values = df[column].fillna('')
+        duplicated |= (values != '') & values.duplicated(keep=False)
+    return df[duplicated]
+
+
+# 在写线程的事务中批量插入，任何一行违反唯一索引都会使整个事务回滚
+def insert_fleet(c, company_id, df):
+    c.executemany(
+        'INSERT INTO ships (company_id, ship_name, imo_number, mmsi) VALUES (?, ?, ?, ?)',
+        [(company_id, row[0], row[1], row[2]) for row in df[COLUMNS].itertuples(index=False)]
+    )
+    return len(df)
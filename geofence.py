@@ -0,0 +1,209 @@
+import os
+import time
+import hashlib
+import sqlite3
+import argparse
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import shapely
+import geopandas as gpd
+
+from schema import init_db
+from track_store import POSITION_FIELD, parse_position
+
+# 排放控制区（ECA/SECA）与港区判定
+# 区域来自两部分：本地 GeoJSON 文件中的排放控制区多边形（属性 name、kind），
+# 以及 sea_port_info.csv 中各海港按半径生成的港区圆。全部区域放入 shapely 的 STRtree，
+# 先按外包矩形批量取候选，再对每个候选区域用预处理过的多边形向量化判定点是否落在区域内。
+# 判定结果写入 report_zones（报告ID, 区域, 类型），提交报告时逐份写入，区域变化时整体重算历史船位。
+DB_PATH = os.environ.get('SHIPTALK_DB', 'shipping_system.db')
+ZONES_PATH = os.environ.get('SHIPTALK_ZONES', 'eca_zones.geojson')
+PORTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sea_port_info.csv')
+
+# 港区半径（海里），内陆港不参与判定
+PORT_RADIUS_NM = {'Main Port': 12, 'Feeder Port': 6}
+# 港区圆的边数
+PORT_SEGMENTS = 32
+CHUNK_SIZE = 200000
+
+
+# 读取排放控制区，返回 [(名称, 类型, 多边形), ...]；文件不存在时返回空列表
+# 跨越 180° 经线的区域需在文件中拆成两部分
+def load_eca_zones(path=ZONES_PATH):
+    if not path or not os.path.exists(path):
+        return []
+    df = gpd.read_file(path)
+    if df.crs is not None and not df.crs.equals('EPSG:4326'):
+        df = df.to_crs('EPSG:4326')
+    names = df['name'] if 'name' in df.columns else pd.Series([f'区域{i + 1}' for i in range(len(df))])
+    kinds = df['kind'] if 'kind' in df.columns else pd.Series(['ECA'] * len(df))
+    return [
+        (str(name), str(kind or 'ECA'), geometry)
+        for name, kind, geometry in zip(names, kinds, df.geometry)
+        if geometry is not None and not geometry.is_empty
+    ]
+
+
+# 按港口位置和半径生成港区，经度方向按纬度余弦放大，使其在地面上近似为圆
+def load_port_zones(path=PORTS_PATH, radius_nm=PORT_RADIUS_NM):
+    if not path or not os.path.exists(path):
+        return []
+    ports = pd.read_csv(path, encoding='gbk')
+    ports = ports[(ports['delete_flag'] == 0) & ports['port_type'].isin(list(radius_nm))]
+    ports = ports.dropna(subset=['latitude', 'longitude']).drop_duplicates('code')
+    lat = ports['latitude'].to_numpy()
+    lon = ports['longitude'].to_numpy()
+    radius = ports['port_type'].map(radius_nm).to_numpy() / 60.0
+    angles = np.linspace(0, 2 * np.pi, PORT_SEGMENTS, endpoint=False)
+    scale = 1 / np.maximum(np.cos(np.radians(lat)), 0.05)
+    rings = np.stack([
+        lon[:, None] + (radius * scale)[:, None] * np.cos(angles),
+        lat[:, None] + radius[:, None] * np.sin(angles),
+    ], axis=-1)
+    polygons = shapely.polygons(rings)
+    names = ports['port_cn_name'].fillna(ports['port_en_name']).fillna(ports['code'])
+    return [
+        (f'{name}（{code}）', 'PORT', polygon)
+        for name, code, polygon in zip(names, ports['code'], polygons)
+    ]
+
+
+class ZoneIndex:
+    def __init__(self, zones):
+        self.names = np.array([zone[0] for zone in zones], dtype=object)
+        self.kinds = np.array([zone[1] for zone in zones], dtype=object)
+        self.geometries = np.array([zone[2] for zone in zones], dtype=object)
+        shapely.prepare(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+        # 区域集合的指纹，区域文件变化后据此重算历史船位
+        digest = hashlib.sha256()
+        for name, kind, geometry in zones:
+            digest.update(f'{name}\0{kind}\0'.encode())
+            digest.update(shapely.to_wkb(geometry))
+        self.fingerprint = digest.hexdigest()
+
+    def __len__(self):
+        return len(self.names)
+
+    # 批量判定，lat、lon 为数组；返回 (点下标, 区域下标) 两个等长数组，一个点可落在多个区域
+    def classify(self, lat, lon):
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+        if not len(self) or not len(lat):
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+        points, zones = self.tree.query(shapely.points(lon, lat))
+        if not len(points):
+            return points, zones
+        # 按区域分组，每个区域对其候选点做一次向量化判定（边界上的点也算在区域内）
+        order = np.argsort(zones, kind='stable')
+        points, zones = points[order], zones[order]
+        starts = np.flatnonzero(np.diff(zones, prepend=-1))
+        inside = np.zeros(len(points), dtype=bool)
+        for start, end in zip(starts, np.append(starts[1:], len(zones))):
+            candidates = points[start:end]
+            inside[start:end] = shapely.intersects_xy(self.geometries[zones[start]], lon[candidates], lat[candidates])
+        return points[inside], zones[inside]
+
+    # 单个位置所在的区域 [(名称, 类型), ...]
+    def zones_at(self, lat, lon):
+        _, zones = self.classify([lat], [lon])
+        return [(self.names[i], self.kinds[i]) for i in zones]
+
+
+def load_zone_index(zones_path=ZONES_PATH, ports_path=PORTS_PATH):
+    return ZoneIndex(load_eca_zones(zones_path) + load_port_zones(ports_path))
+
+
+# 在写线程的事务中为一份报告写入所在区域，data 为报告字段
+def tag_report(c, index, report_id, data):
+    c.execute('DELETE FROM report_zones WHERE report_id = ?', (report_id,))
+    position = parse_position(data.get(POSITION_FIELD))
+    if position is None:
+        return []
+    zones = index.zones_at(*position)
+    c.executemany(
+        'INSERT INTO report_zones (report_id, zone, kind) VALUES (?, ?, ?)',
+        [(report_id, name, kind) for name, kind in zones]
+    )
+    return zones
+
+
+# 按 ship_positions 中的全部船位重算 report_zones（每份有船位的报告在表中都有记录）
+# 用单独的游标分块读取（fetchmany），内存占用与历史总量无关；每块向量化判定后写入
+def retag_history(c, index, chunk_size=CHUNK_SIZE):
+    c.execute('DELETE FROM report_zones')
+    reader = c.connection.cursor()
+    reader.execute('SELECT report_id, lat, lon FROM ship_positions WHERE report_id IS NOT NULL')
+    tagged = 0
+    while True:
+        rows = reader.fetchmany(chunk_size)
+        if not rows:
+            break
+        chunk = np.array(rows, dtype=float).reshape(-1, 3)
+        points, zones = index.classify(chunk[:, 1], chunk[:, 2])
+        report_ids = chunk[points, 0].astype(np.int64).tolist()
+        c.executemany(
+            'INSERT OR IGNORE INTO report_zones (report_id, zone, kind) VALUES (?, ?, ?)',
+            zip(report_ids, index.names[zones].tolist(), index.kinds[zones].tolist())
+        )
+        tagged += len(points)
+    reader.close()
+    c.execute(
+        'INSERT OR REPLACE INTO geofence_state (key, value) VALUES (?, ?)',
+        ('fingerprint', index.fingerprint)
+    )
+    c.execute(
+        'INSERT OR REPLACE INTO geofence_state (key, value) VALUES (?, ?)',
+        ('tagged_at', datetime.now().isoformat(timespec='seconds'))
+    )
+    return tagged
+
+
+# 区域集合与上次重算时不同（或从未重算）时重算历史船位，返回是否重算
+def sync_history(c, index):
+    row = c.execute("SELECT value FROM geofence_state WHERE key = 'fingerprint'").fetchone()
+    if row and row[0] == index.fingerprint:
+        return False
+    retag_history(c, index)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ShipTalk 排放控制区与港区判定')
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--zones', default=ZONES_PATH, help='排放控制区 GeoJSON 文件')
+    parser.add_argument('--ports', default=PORTS_PATH, help='港口信息 CSV 文件')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('retag', help='重算全部历史船位所在区域')
+    locate = sub.add_parser('locate', help='查询一个位置所在的区域')
+    locate.add_argument('position', help='船位，例如 "31°14\'N 121°29\'E"')
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    index = load_zone_index(args.zones, args.ports)
+    print(f'已加载 {len(index)} 个区域，用时 {time.monotonic() - started:.2f} 秒')
+
+    if args.command == 'locate':
+        position = parse_position(args.position)
+        if position is None:
+            print('无法解析船位。')
+            return
+        zones = index.zones_at(*position)
+        print('、'.join(f'{name}（{kind}）' for name, kind in zones) if zones else '不在任何区域内')
+        return
+
+    conn = sqlite3.connect(args.db, timeout=30)
+    try:
+        init_db(conn.cursor())
+        started = time.monotonic()
+        tagged = retag_history(conn.cursor(), index)
+        conn.commit()
+    finally:
+        conn.close()
+    print(f'已重算历史船位，{tagged} 条区域记录，用时 {time.monotonic() - started:.2f} 秒')
+
+
+if __name__ == '__main__':
+    main()
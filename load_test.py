@@ -0,0 +1,450 @@
+import os
+import sys
+import time
+import random
+import shutil
+import socket
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+
+import bcrypt
+from tornado.websocket import websocket_connect
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+from schema import init_db
+
+# 并发会话压测：在本地启动应用，模拟大量船员同时登录、打开报告填报页、逐项填写模板字段并提交，
+# 邮件发送到本地 SMTP 接收端。统计每次页面重跑（rerun）的延迟分位数、错误率和报告提交吞吐，
+# 超出设定的 SLO 时以非零状态退出。
+#
+# 客户端直接使用 Streamlit 的 WebSocket 协议（与浏览器相同）：发送 BackMsg.rerun_script
+# 携带各控件状态，等待 ForwardMsg.script_finished 作为一次重跑结束。
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'streamlit_app.py')
+PASSWORD = 'Load123!'
+TEMPLATE_FIELDS = '航次编号,填报日期,船舶位置,平均航速,24小时耗油量,船舶燃油存量,24小时航行里程,剩余航行里程,预计抵港时间,始发港,目的港'
+
+_FINISHED = {
+    ForwardMsg.FINISHED_SUCCESSFULLY,
+    ForwardMsg.FINISHED_WITH_COMPILE_ERROR,
+    ForwardMsg.FINISHED_FRAGMENT_RUN_SUCCESSFULLY,
+}
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        # 逐项填写字段时的重跑延迟（报告填报表单在 fragment 中时只重跑表单部分）
+        self.field_latencies = []
+        self.reruns = 0
+        self.errors = {}
+        self.submitted = 0
+        self.failed_users = 0
+
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def percentile(self, p, latencies=None):
+        values = sorted(self.latencies if latencies is None else latencies)
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+    def error_rate(self):
+        return sum(self.errors.values()) / max(self.reruns, 1)
+
+
+# 一个模拟用户的浏览器会话
+class Session:
+    def __init__(self, url, stats, timeout):
+        self.url = url
+        self.stats = stats
+        self.timeout = timeout
+        self.ws = None
+        # 当前页面上的控件：标签 -> (控件ID, 类型, 选项, 所在 fragment ID)
+        self.widgets = {}
+        # 已设置的控件值：标签 -> (类型, 值)，每次重跑都重新发送
+        self.values = {}
+        # 上次重跑之后修改的控件，其所在 fragment 决定是否只重跑该 fragment（与浏览器行为一致）
+        self.changed = None
+        self.alerts = []
+        self.exceptions = []
+
+    async def connect(self):
+        self.ws = await websocket_connect(self.url, subprotocols=['streamlit'])
+
+    def close(self):
+        if self.ws:
+            self.ws.close()
+
+    def _collect(self, msg):
+        kind = msg.WhichOneof('type')
+        if kind == 'new_session':
+            # fragment 重跑只替换 fragment 内的元素，其余控件保留
+            if not msg.new_session.fragment_ids_this_run:
+                self.widgets = {}
+        elif kind == 'delta' and msg.delta.WhichOneof('type') == 'new_element':
+            element = msg.delta.new_element
+            element_type = element.WhichOneof('type')
+            if element_type in ('text_input', 'button', 'radio', 'selectbox'):
+                widget = getattr(element, element_type)
+                options = list(widget.options) if element_type in ('radio', 'selectbox') else None
+                self.widgets[widget.label] = (widget.id, element_type, options, msg.delta.fragment_id)
+            elif element_type == 'exception':
+                self.exceptions.append(element.exception.message)
+            elif element_type == 'alert' and element.alert.format == element.alert.ERROR:
+                self.alerts.append(element.alert.body)
+
+    # 发送一次重跑请求并等待完成，trigger 为本次点击的按钮标签
+    async def rerun(self, trigger=None):
+        back = BackMsg()
+        back.rerun_script.SetInParent()
+        source = trigger or self.changed
+        if source in self.widgets:
+            back.rerun_script.fragment_id = self.widgets[source][3]
+        self.changed = None
+        states = back.rerun_script.widget_states
+        for label, (kind, value) in self.values.items():
+            if label not in self.widgets:
+                continue
+            state = states.widgets.add()
+            state.id = self.widgets[label][0]
+            if kind == 'text_input':
+                state.string_value = value
+            else:
+                state.int_value = value
+        if trigger is not None:
+            state = states.widgets.add()
+            state.id = self.widgets[trigger][0]
+            state.trigger_value = True
+
+        self.alerts = []
+        self.exceptions = []
+        started = time.perf_counter()
+        await self.ws.write_message(back.SerializeToString(), binary=True)
+        while True:
+            raw = await asyncio.wait_for(self.ws.read_message(), self.timeout)
+            if raw is None:
+                raise ConnectionError('连接已关闭')
+            msg = ForwardMsg()
+            msg.ParseFromString(raw)
+            self._collect(msg)
+            if msg.WhichOneof('type') == 'script_finished' and msg.script_finished in _FINISHED:
+                break
+        latency = time.perf_counter() - started
+        self.stats.latencies.append(latency)
+        self.stats.reruns += 1
+        for message in self.exceptions + self.alerts:
+            if 'database is locked' in message:
+                self.stats.error('database is locked')
+        if self.exceptions:
+            self.stats.error('exception')
+        return latency
+
+    def set_text(self, label, value):
+        self.values[label] = ('text_input', value)
+        self.changed = label
+
+    def choose(self, label, option):
+        _, kind, options, _ = self.widgets[label]
+        self.values[label] = (kind, options.index(option))
+        self.changed = label
+
+
+async def simulate_user(url, user_no, company_name, ship_count, reports, stats, timeout, email):
+    session = Session(url, stats, timeout)
+    try:
+        await session.connect()
+        await session.rerun()
+
+        # 登录
+        session.set_text('公司名称', company_name)
+        session.set_text('密码', PASSWORD)
+        await session.rerun(trigger='登录')
+
+        # 打开报告填报页，选择本用户负责的船舶
+        session.choose('🚢选择功能', '报告填报')
+        await session.rerun()
+        ship_options = session.widgets['选择船舶'][2]
+        session.choose('选择船舶', ship_options[user_no % ship_count])
+        await session.rerun()
+
+        for report_no in range(reports):
+            # 逐项填写模板字段，每个字段触发一次重跑
+            for field in TEMPLATE_FIELDS.split(','):
+                session.set_text(field, _field_value(field, report_no))
+                stats.field_latencies.append(await session.rerun())
+            session.set_text('请输入收件人邮箱地址', email)
+            await session.rerun()
+            await session.rerun(trigger='提交报告')
+            if session.exceptions:
+                stats.error('submit failed')
+            else:
+                stats.submitted += 1
+    except (asyncio.TimeoutError, ConnectionError, KeyError, OSError) as e:
+        stats.failed_users += 1
+        stats.error(type(e).__name__)
+    finally:
+        session.close()
+
+
+def _field_value(field, report_no):
+    values = {
+        '航次编号': f'V{report_no:03d}',
+        '填报日期': time.strftime('%Y%m%d'),
+        '船舶位置': f'{random.uniform(-60, 60):.2f}N {random.uniform(0, 180):.2f}E',
+        '平均航速': f'{random.gauss(13, 0.5):.1f}',
+        '24小时耗油量': f'{random.gauss(26, 1):.1f}',
+        '船舶燃油存量': f'{random.uniform(300, 900):.1f}',
+        '24小时航行里程': f'{random.gauss(310, 10):.0f}',
+        '剩余航行里程': f'{random.uniform(100, 3000):.0f}',
+    }
+    return values.get(field, f'{field}-{report_no}')
+
+
+# 本地 SMTP 接收端：接收并丢弃邮件
+class SMTPSink:
+    def __init__(self):
+        self.messages = 0
+
+    async def handle(self, reader, writer):
+        writer.write(b'220 localhost SMTP sink\r\n')
+        in_data = False
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if in_data:
+                if line == b'.\r\n':
+                    in_data = False
+                    self.messages += 1
+                    writer.write(b'250 OK\r\n')
+                continue
+            command = line[:4].upper()
+            if command in (b'EHLO', b'HELO'):
+                writer.write(b'250 localhost\r\n')
+            elif command == b'DATA':
+                in_data = True
+                writer.write(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+            elif command == b'QUIT':
+                writer.write(b'221 Bye\r\n')
+                await writer.drain()
+                break
+            else:
+                writer.write(b'250 OK\r\n')
+            await writer.drain()
+        writer.close()
+
+    async def start(self, port):
+        return await asyncio.start_server(self.handle, '127.0.0.1', port)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# 准备压测数据库：若干公司，每家若干船舶和一个午报模板
+def prepare_database(path, companies, ships_per_company):
+    conn = sqlite3.connect(path)
+    init_db(conn.cursor())
+    hashed_pw = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt())
+    names = []
+    for i in range(companies):
+        name = f'压测公司{i + 1}'
+        company_id = conn.execute('INSERT INTO companies (company_name, password) VALUES (?, ?)', (name, hashed_pw)).lastrowid
+        conn.executemany(
+            'INSERT INTO ships (company_id, ship_name, imo_number, mmsi) VALUES (?, ?, ?, ?)',
+            [(company_id, f'{name}-船{j + 1}', '', '') for j in range(ships_per_company)]
+        )
+        conn.execute('INSERT INTO report_templates (company_id, report_type, fields) VALUES (?, ?, ?)',
+                     (company_id, '午报', TEMPLATE_FIELDS))
+        names.append(name)
+    conn.commit()
+    conn.close()
+    return names
+
+
+def _wait_healthy(port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/_stcore/health', timeout=2) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError(f'应用在 {timeout} 秒内未启动（端口 {port}）')
+
+
+# pin 为 True 时每个应用进程绑定到一个 CPU 核（仅 Linux），进程数即使用的核数
+def launch_app(workdir, db_path, smtp_port, workers, pin=False):
+    env = dict(os.environ)
+    env.update({
+        'SHIPTALK_DB': db_path,
+        'SHIPTALK_SMTP_HOST': '127.0.0.1',
+        'SHIPTALK_SMTP_PORT': str(smtp_port),
+        'SHIPTALK_SMTP_SSL': '0',
+        'SHIPTALK_SMTP_PASSWORD': '',
+    })
+    base_port = _free_port()
+    ports = [base_port + i for i in range(workers)]
+    if workers > 1:
+        env['SHIPTALK_SHARED_STATE'] = os.path.join(workdir, 'shared_state.db')
+    cpus = sorted(os.sched_getaffinity(0)) if pin else None
+    processes = []
+    for i, port in enumerate(ports):
+        log = open(os.path.join(workdir, f'app_{port}.log'), 'w')
+        preexec_fn = (lambda cpu=cpus[i % len(cpus)]: os.sched_setaffinity(0, {cpu})) if pin else None
+        processes.append(subprocess.Popen([
+            sys.executable, '-m', 'streamlit', 'run', APP_PATH,
+            '--server.port', str(port),
+            '--server.address', '127.0.0.1',
+            '--server.headless', 'true',
+            '--server.enableXsrfProtection', 'false',
+            '--server.fileWatcherType', 'none',
+            '--browser.gatherUsageStats', 'false',
+        ], env=env, stdout=log, stderr=subprocess.STDOUT, preexec_fn=preexec_fn))
+    for port in ports:
+        _wait_healthy(port)
+    return processes, [f'ws://127.0.0.1:{port}/_stcore/stream' for port in ports]
+
+
+def submitted_reports(db_path, since):
+    conn = sqlite3.connect(db_path)
+    count = conn.execute(
+        "SELECT COUNT(*) FROM reports WHERE status = 'submitted' AND submitted_at >= ?", (since,)
+    ).fetchone()[0]
+    conn.close()
+    return count
+
+
+async def run_load(urls, company_names, args, stats):
+    tasks = []
+    for user_no in range(args.users):
+        url = urls[user_no % len(urls)]
+        company_name = company_names[user_no % len(company_names)]
+        tasks.append(asyncio.create_task(simulate_user(
+            url, user_no, company_name, args.ships_per_company, args.reports, stats, args.timeout,
+            f'crew{user_no}@example.com'
+        )))
+        # 在 ramp 秒内均匀启动所有用户
+        await asyncio.sleep(args.ramp / max(args.users, 1))
+    await asyncio.gather(*tasks)
+
+
+def report(stats, elapsed, submitted, args):
+    print(f'用户数：{args.users}，失败用户：{stats.failed_users}，重跑次数：{stats.reruns}，耗时：{elapsed:.1f} 秒')
+    print(f'重跑延迟 p50={stats.percentile(50) * 1000:.0f}ms '
+          f'p95={stats.percentile(95) * 1000:.0f}ms p99={stats.percentile(99) * 1000:.0f}ms')
+    print(f'其中填写字段 p50={stats.percentile(50, stats.field_latencies) * 1000:.0f}ms '
+          f'p95={stats.percentile(95, stats.field_latencies) * 1000:.0f}ms '
+          f'p99={stats.percentile(99, stats.field_latencies) * 1000:.0f}ms')
+    print(f'错误率：{stats.error_rate():.2%} {stats.errors or ""}')
+    print(f'报告提交：{submitted} 份，吞吐 {submitted / max(elapsed, 1e-9):.1f} 份/秒；'
+          f'重跑吞吐 {stats.reruns / max(elapsed, 1e-9):.1f} 次/秒')
+
+    breaches = []
+    if args.slo_p50 and stats.percentile(50) * 1000 > args.slo_p50:
+        breaches.append(f'p50 超过 {args.slo_p50}ms')
+    if args.slo_p95 and stats.percentile(95) * 1000 > args.slo_p95:
+        breaches.append(f'p95 超过 {args.slo_p95}ms')
+    if args.slo_p99 and stats.percentile(99) * 1000 > args.slo_p99:
+        breaches.append(f'p99 超过 {args.slo_p99}ms')
+    if stats.error_rate() > args.max_error_rate:
+        breaches.append(f'错误率超过 {args.max_error_rate:.2%}')
+    if stats.failed_users > args.max_failed_users:
+        breaches.append(f'失败用户超过 {args.max_failed_users}')
+    for breach in breaches:
+        print(f'SLO 未达标：{breach}')
+    return not breaches
+
+
+# 按指定的应用进程数压测一轮，返回 (是否达标, 本轮摘要)
+def run_once(args, workers, loop, smtp_port, sink):
+    workdir = tempfile.mkdtemp(prefix='shiptalk-load-')
+    db_path = os.path.join(workdir, 'load.db')
+    messages = sink.messages
+
+    try:
+        company_names = prepare_database(db_path, args.companies, args.ships_per_company)
+        processes, urls = launch_app(workdir, db_path, smtp_port, workers, args.pin)
+        stats = Stats()
+        started_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+        started = time.perf_counter()
+        try:
+            loop.run_until_complete(run_load(urls, company_names, args, stats))
+        finally:
+            elapsed = time.perf_counter() - started
+            for p in processes:
+                p.terminate()
+            for p in processes:
+                p.wait()
+
+        submitted = submitted_reports(db_path, started_at)
+        print(f'--- 应用进程数：{workers} ---')
+        ok = report(stats, elapsed, submitted, args)
+        print(f'SMTP 接收端收到邮件：{sink.messages - messages} 封')
+    finally:
+        if args.keep:
+            print(f'压测数据目录：{workdir}')
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return ok, (workers, submitted / max(elapsed, 1e-9), stats.reruns / max(elapsed, 1e-9),
+                stats.percentile(50), stats.percentile(95))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ShipTalk 并发会话压测')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--ramp', type=float, default=10, help='在多少秒内启动全部用户')
+    parser.add_argument('--reports', type=int, default=1, help='每个用户提交的报告数')
+    parser.add_argument('--companies', type=int, default=10)
+    parser.add_argument('--ships-per-company', type=int, default=20)
+    parser.add_argument('--workers', default='1',
+                        help='应用进程数（>1 时启用多进程模式）；逗号分隔多个值（如 1,2,4）时依次压测，比较吞吐随进程数的变化')
+    parser.add_argument('--pin', action='store_true', help='每个应用进程绑定一个 CPU 核，使进程数等于使用的核数')
+    parser.add_argument('--timeout', type=float, default=60, help='单次重跑超时（秒）')
+    parser.add_argument('--slo-p50', type=float, default=0, help='p50 延迟上限（毫秒），0 表示不检查')
+    parser.add_argument('--slo-p95', type=float, default=2000)
+    parser.add_argument('--slo-p99', type=float, default=5000)
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--max-failed-users', type=int, default=0)
+    parser.add_argument('--keep', action='store_true', help='保留压测数据库和日志目录')
+    args = parser.parse_args()
+    worker_counts = [int(n) for n in args.workers.split(',')]
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    sink = SMTPSink()
+    smtp_port = _free_port()
+    smtp_server = loop.run_until_complete(sink.start(smtp_port))
+
+    results = []
+    all_ok = True
+    try:
+        for workers in worker_counts:
+            ok, summary = run_once(args, workers, loop, smtp_port, sink)
+            all_ok = all_ok and ok
+            results.append(summary)
+    finally:
+        smtp_server.close()
+
+    if len(results) > 1:
+        print(f'吞吐随应用进程数的变化（本机 {len(os.sched_getaffinity(0))} 个可用 CPU 核）：')
+        print('进程数  报告/秒  重跑/秒  相对首轮  p50(ms)  p95(ms)')
+        base = results[0][2]
+        for workers, reports_per_s, reruns_per_s, p50, p95 in results:
+            print(f'{workers:>6}  {reports_per_s:>7.1f}  {reruns_per_s:>7.1f}  {reruns_per_s / base:>7.2f}x  '
+                  f'{p50 * 1000:>7.0f}  {p95 * 1000:>7.0f}')
+    sys.exit(0 if all_ok else 1)
+
+
+if __name__ == '__main__':
+    main()
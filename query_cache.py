@@ -0,0 +1,76 @@
+import time
+import threading
+from collections import OrderedDict
+
+# 船舶、报告模板查询的共享缓存
+# 以公司为单位维护代数（generation），每次写入 ships 或 report_templates 后代数加一，
+# 缓存条目记录写入时的代数，代数不一致即视为过期；所有会话共享同一份缓存，
+# 因此任何会话的修改都会让其他会话立即读到新数据。条目数量有上限，按最近最少使用淘汰。
+# 多进程部署时传入 shared（shared_state.SharedState），失效事件经共享存储广播给其他进程，
+# 读取前最多每 poll_interval 秒轮询一次其他进程的失效事件。
+class QueryCache:
+    def __init__(self, max_entries=1024, shared=None, poll_interval=0.2):
+        self.max_entries = max_entries
+        self.shared = shared
+        self.poll_interval = poll_interval
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+        self._last_seq = shared.last_seq() if shared else 0
+        self._last_poll = 0.0
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def generation(self, company_id):
+        return self._generations.get(company_id, 0)
+
+    # 写入提交后调用，使该公司的所有缓存条目失效
+    def invalidate(self, company_id):
+        with self._lock:
+            self._bump(company_id)
+        if self.shared:
+            self.shared.publish_invalidation(company_id)
+
+    def _bump(self, company_id):
+        self._generations[company_id] = self.generation(company_id) + 1
+
+    # 应用其他进程发布的失效事件
+    def _poll_shared(self):
+        now = time.monotonic()
+        if now - self._last_poll < self.poll_interval:
+            return
+        self._last_poll = now
+        seq, companies = self.shared.poll_invalidations(self._last_seq)
+        with self._lock:
+            self._last_seq = seq
+            if companies is None:
+                # 错过了部分事件，全部失效
+                for company_id in {key[0] for key in self._entries} | set(self._generations):
+                    self._bump(company_id)
+            else:
+                for company_id in set(companies):
+                    self._bump(company_id)
+
+    # 读取缓存，未命中或已过期时调用 loader() 查询数据库
+    def get(self, company_id, name, loader, *args):
+        key = (company_id, name, args)
+        if self.shared:
+            self._poll_shared()
+        with self._lock:
+            generation = self.generation(company_id)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generation:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry[1]
+            self.stats['misses'] += 1
+
+        value = loader(*args)
+        with self._lock:
+            # 查询期间若发生写入，代数已变化，不缓存可能过期的结果
+            if self.generation(company_id) == generation:
+                self._entries[key] = (generation, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.stats['evictions'] += 1
+        return value
@@ -0,0 +1,248 @@
+import re
+import ast
+
+from anomaly import parse_number
+
+# 报告模板中的派生字段
+# 模板字段仍以逗号分隔，字段可以写成 "名称=公式"，例如：
+#   船舶燃油存量=上次.船舶燃油存量-24小时耗油量
+#   剩余航行里程=上次.剩余航行里程-24小时航行里程
+#   航次编号=上次.航次编号
+# 公式支持 + - * / 和括号；"上次.字段" 取本船上一份已提交报告中的值，不带前缀的字段取本次报告中的值。
+# 上一份报告中该字段为空时不向更早的报告回溯（否则燃油存量等递推字段会从旧值算起），派生字段留空由船员填写。
+# 公式只有单个引用时原样复制文本（航次编号、港口等），否则按数值计算（从 "480吨" 这类文本中提取数字）。
+# 模板编译为依赖图：一个字段修改时只按拓扑顺序重算依赖它的派生字段，重算成本与模板大小无关。
+PREVIOUS = '上次.'
+
+_TOKEN = re.compile(r'\s*(?:([+\-*/()])|([^\s+\-*/()]+))')
+_NUMBER = re.compile(r'\d+(?:\.\d+)?')
+
+
+# 按逗号拆分模板字段，返回 [(名称, 公式或 None), ...]
+def parse_template(text):
+    entries = []
+    for entry in (text or '').split(','):
+        name, _, formula = entry.partition('=')
+        name = name.strip()
+        if name:
+            entries.append((name, formula.strip() or None))
+    return entries
+
+
+# 模板中的字段名称（不含公式），用于填报、同步时确定字段顺序
+def field_names(text):
+    return [name for name, _ in parse_template(text)]
+
+
+def _format(value):
+    text = f'{value:.2f}'.rstrip('0').rstrip('.')
+    return '0' if text == '-0' else text
+
+
+def _tokenize(formula):
+    tokens = []
+    position = 0
+    formula = formula.strip()
+    while position < len(formula):
+        match = _TOKEN.match(formula, position)
+        if not match:
+            raise ValueError(f'无法解析公式：{formula}')
+        tokens.append(match.group(1) or match.group(2))
+        position = match.end()
+    return tokens
+
+
+# 递归下降解析，生成 (计算函数, 引用的本次报告字段, 引用的上次报告字段)
+# 计算函数的参数为 (本次报告值, 上次报告值)，数值计算中任何一项缺失时结果为 None
+class _Parser:
+    def __init__(self, formula):
+        self.formula = formula
+        self.tokens = _tokenize(formula)
+        self.position = 0
+        self.current = set()
+        self.previous = set()
+
+    def _peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _next(self):
+        token = self._peek()
+        if token is None:
+            raise ValueError(f'公式不完整：{self.formula}')
+        self.position += 1
+        return token
+
+    def parse(self):
+        if len(self.tokens) == 1 and self.tokens[0] not in '+-*/()' and not _NUMBER.fullmatch(self.tokens[0]):
+            # 单个引用：原样复制文本
+            read = self._reference(self.tokens[0])
+            evaluate = lambda current, previous: read(current, previous) or ''
+        else:
+            node = self._expression()
+            if self._peek() is not None:
+                raise ValueError(f'公式中有多余的内容：{self.formula}')
+
+            def evaluate(current, previous):
+                value = node(current, previous)
+                return '' if value is None else _format(value)
+        return evaluate, self.current, self.previous
+
+    def _expression(self):
+        node = self._term()
+        while self._peek() in ('+', '-'):
+            node = _binary(self._next(), node, self._term())
+        return node
+
+    def _term(self):
+        node = self._factor()
+        while self._peek() in ('*', '/'):
+            node = _binary(self._next(), node, self._factor())
+        return node
+
+    def _factor(self):
+        token = self._next()
+        if token == '-':
+            operand = self._factor()
+            return lambda current, previous: _negate(operand(current, previous))
+        if token == '(':
+            node = self._expression()
+            if self._next() != ')':
+                raise ValueError(f'括号不匹配：{self.formula}')
+            return node
+        if token in '+*/)':
+            raise ValueError(f'公式中 {token} 的位置不正确：{self.formula}')
+        if _NUMBER.fullmatch(token):
+            constant = float(token)
+            return lambda current, previous: constant
+        read = self._reference(token)
+        return lambda current, previous: parse_number(read(current, previous))
+
+    def _reference(self, token):
+        if token.startswith(PREVIOUS):
+            name = token[len(PREVIOUS):]
+            self.previous.add(name)
+            return lambda current, previous: previous.get(name)
+        self.current.add(token)
+        return lambda current, previous: current.get(token)
+
+
+def _negate(value):
+    return None if value is None else -value
+
+
+def _binary(operator, left, right):
+    def evaluate(current, previous):
+        a, b = left(current, previous), right(current, previous)
+        if a is None or b is None:
+            return None
+        if operator == '+':
+            return a + b
+        if operator == '-':
+            return a - b
+        if operator == '*':
+            return a * b
+        return a / b if b else None
+    return evaluate
+
+
+# 编译后的模板。模板有误（引用不存在的字段、循环引用、语法错误）时抛出 ValueError
+class FormulaEngine:
+    def __init__(self, text):
+        entries = parse_template(text)
+        self.fields = [name for name, _ in entries]
+        self.formulas = {}
+        self.sources = {}
+        # 派生字段引用的上一份报告字段
+        self.previous_refs = {}
+        dependencies = {}
+        for name, formula in entries:
+            if formula is None:
+                continue
+            evaluate, current, previous = _Parser(formula).parse()
+            unknown = current - set(self.fields)
+            if unknown:
+                raise ValueError(f"字段 {name} 的公式引用了模板中不存在的字段：{'、'.join(sorted(unknown))}")
+            self.formulas[name] = evaluate
+            self.sources[name] = formula
+            if previous:
+                self.previous_refs[name] = sorted(previous)
+            dependencies[name] = current
+
+        # 拓扑排序（Kahn 算法），派生字段总在它依赖的字段之后计算
+        dependents = {name: [] for name in self.fields}
+        pending = {name: len(deps) for name, deps in dependencies.items()}
+        for name, deps in dependencies.items():
+            for dep in deps:
+                dependents[dep].append(name)
+        ready = [name for name in self.fields if pending.get(name, 0) == 0]
+        self.order = []
+        while ready:
+            name = ready.pop(0)
+            self.order.append(name)
+            for dependent in dependents[name]:
+                pending[dependent] -= 1
+                if pending[dependent] == 0:
+                    ready.append(dependent)
+        if len(self.order) != len(self.fields):
+            cycle = [name for name in self.fields if name not in self.order]
+            raise ValueError(f"公式存在循环引用：{'、'.join(cycle)}")
+
+        # 每个字段修改后需要重算的派生字段（按拓扑顺序），编译时一次算好
+        rank = {name: i for i, name in enumerate(self.order)}
+        self.affected = {}
+        for name in self.fields:
+            seen = set()
+            stack = list(dependents[name])
+            while stack:
+                dependent = stack.pop()
+                if dependent not in seen:
+                    seen.add(dependent)
+                    stack.extend(dependents[dependent])
+            self.affected[name] = sorted(seen, key=rank.get)
+
+    def _recompute(self, names, data, previous, manual):
+        changed = {}
+        for name in names:
+            if name in manual:
+                continue
+            value = self.formulas[name](data, previous)
+            if value != data.get(name):
+                data[name] = value
+                changed[name] = value
+        return changed
+
+    # 计算全部派生字段（切换船舶、报告类型时），manual 为用户手动改写过的派生字段，不覆盖
+    # 直接修改 data，返回 {字段: 新值}
+    def compute_all(self, data, previous, manual=()):
+        return self._recompute([name for name in self.order if name in self.formulas], data, previous, manual)
+
+    # 字段 field 修改后只重算依赖它的派生字段
+    def update(self, data, previous, field, manual=()):
+        return self._recompute(self.affected.get(field, ()), data, previous, manual)
+
+    # 上一份报告中缺少引用值、无法自动计算的派生字段，返回 {字段: [缺少的上次字段, ...]}
+    def missing_previous(self, previous):
+        missing = {}
+        for name, refs in self.previous_refs.items():
+            absent = [ref for ref in refs if ref not in previous]
+            if absent:
+                missing[name] = absent
+        return missing
+
+
+# 本船上一份已提交报告中各字段的值，只取紧邻的一份，为空的字段视为缺失（不出现在结果中）
+def previous_values(c, ship_id):
+    row = c.execute(
+        '''SELECT data FROM reports WHERE ship_id = ? AND status = 'submitted'
+           ORDER BY id DESC LIMIT 1''',
+        (ship_id,)
+    ).fetchone()
+    if row is None:
+        return {}
+    try:
+        report = ast.literal_eval(row[0])
+    except (ValueError, SyntaxError):
+        return {}
+    if not isinstance(report, dict):
+        return {}
+    return {key: value for key, value in report.items() if str(value).strip()}
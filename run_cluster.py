@@ -0,0 +1,127 @@
+import os
+import sys
+import time
+import shutil
+import secrets
+import argparse
+import subprocess
+
+# 多进程部署：在本机启动多个 Streamlit 应用进程，并由 nginx 反向代理统一对外提供服务。
+# Streamlit 的会话保存在处理该连接的进程内存中，文件上传（PUT /_stcore/upload_file/<会话ID>）
+# 等 HTTP 请求必须到达同一进程，因此代理按客户端地址做一致性哈希，同一客户端总是转发到同一进程。
+# 各进程通过 SHIPTALK_SHARED_STATE 指定的共享存储同步登录会话和缓存失效事件，
+# 进程重启或增减后客户端被转发到其他进程时，据此恢复登录状态。
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'streamlit_app.py')
+
+NGINX_CONF = '''
+worker_processes auto;
+pid {workdir}/nginx.pid;
+error_log {workdir}/nginx_error.log;
+
+events {{
+    worker_connections 4096;
+}}
+
+http {{
+    access_log off;
+    client_body_temp_path {workdir}/client_body;
+    proxy_temp_path {workdir}/proxy;
+    fastcgi_temp_path {workdir}/fastcgi;
+    uwsgi_temp_path {workdir}/uwsgi;
+    scgi_temp_path {workdir}/scgi;
+
+    map $http_upgrade $connection_upgrade {{
+        default upgrade;
+        ''      close;
+    }}
+
+    upstream shiptalk {{
+        # 会话粘滞：同一客户端地址总是转发到同一进程，增减进程时只有少量客户端改变去向
+        hash $remote_addr consistent;
+{servers}
+    }}
+
+    server {{
+        listen {port};
+
+        location / {{
+            proxy_pass http://shiptalk;
+            proxy_http_version 1.1;
+            proxy_set_header Host $host;
+            proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+            # 登录会话令牌绑定的客户端地址
+            proxy_set_header X-Real-IP $remote_addr;
+            # Streamlit 通过 WebSocket 与浏览器通信
+            proxy_set_header Upgrade $http_upgrade;
+            proxy_set_header Connection $connection_upgrade;
+            proxy_read_timeout 86400;
+        }}
+    }}
+}}
+'''
+
+
+def write_nginx_conf(workdir, port, app_ports):
+    servers = '\n'.join(f'        server 127.0.0.1:{p};' for p in app_ports)
+    path = os.path.join(workdir, 'nginx.conf')
+    with open(path, 'w') as f:
+        f.write(NGINX_CONF.format(workdir=os.path.abspath(workdir), port=port, servers=servers))
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='以多进程模式运行 ShipTalk')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='应用进程数，默认等于 CPU 核数')
+    parser.add_argument('--port', type=int, default=8501, help='反向代理对外端口')
+    parser.add_argument('--base-port', type=int, default=8601, help='应用进程起始端口')
+    parser.add_argument('--workdir', default='.cluster', help='共享存储、nginx 配置和日志目录')
+    parser.add_argument('--no-proxy', action='store_true', help='只启动应用进程，由外部代理转发（需按客户端做会话粘滞并设置 X-Real-IP）')
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    env = dict(os.environ)
+    env['SHIPTALK_SHARED_STATE'] = os.path.abspath(os.path.join(args.workdir, 'shared_state.db'))
+    app_ports = [args.base_port + i for i in range(args.workers)]
+    # 所有进程使用相同的 cookie 密钥，代理转发到任一进程都能通过校验
+    env.setdefault('STREAMLIT_SERVER_COOKIE_SECRET', secrets.token_hex(32))
+
+    processes = []
+    for port in app_ports:
+        log = open(os.path.join(args.workdir, f'app_{port}.log'), 'w')
+        processes.append(subprocess.Popen([
+            sys.executable, '-m', 'streamlit', 'run', APP_PATH,
+            '--server.port', str(port),
+            '--server.address', '127.0.0.1',
+            '--server.headless', 'true',
+            '--server.fileWatcherType', 'none',
+        ], env=env, stdout=log, stderr=subprocess.STDOUT))
+
+    if not args.no_proxy:
+        nginx = shutil.which('nginx')
+        if nginx is None:
+            print('未找到 nginx，请安装后重试，或使用 --no-proxy 自行配置代理。')
+            for p in processes:
+                p.terminate()
+            sys.exit(1)
+        conf = write_nginx_conf(args.workdir, args.port, app_ports)
+        processes.append(subprocess.Popen([nginx, '-c', conf, '-g', 'daemon off;']))
+        print(f'ShipTalk 已启动：http://localhost:{args.port}（{args.workers} 个应用进程）')
+    else:
+        print('应用进程端口：' + ', '.join(map(str, app_ports)))
+
+    try:
+        while all(p.poll() is None for p in processes):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for p in processes:
+            if p.poll() is None:
+                p.terminate()
+        for p in processes:
+            p.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+import sys
+import sqlite3
+
+from track_store import backfill_positions
+
+
+# 给已有表补充新列（旧数据库升级用）
+def add_column(c, table, column, decl):
+    columns = [row[1] for row in c.execute(f'PRAGMA table_info({table})').fetchall()]
+    if column not in columns:
+        c.execute(f'ALTER TABLE {table} ADD COLUMN {column} {decl}')
+
+
+# 同一公司内 IMO 编号和 MMSI 不得重复。旧数据中已有重复时无法建立唯一索引，
+# 返回未建立索引的列；重复的船舶删除后再次调用即可建立
+def create_ship_indexes(c):
+    missing = []
+    for column in ('imo_number', 'mmsi'):
+        try:
+            c.execute(f'''
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_ships_company_{column} ON ships (company_id, {column})
+                WHERE {column} IS NOT NULL AND {column} != ''
+            ''')
+        except sqlite3.IntegrityError:
+            missing.append(column)
+    return missing
+
+
+# 数据库初始化函数
+def init_db(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS companies (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            company_name TEXT UNIQUE,
+            password BLOB
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ships (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            company_id INTEGER,
+            ship_name TEXT,
+            imo_number TEXT,
+            mmsi TEXT,
+            FOREIGN KEY (company_id) REFERENCES companies(id)
+        )
+    ''')
+    for column in create_ship_indexes(c):
+        print(f'警告：ships 表中同一公司存在重复的 {column}，唯一索引 idx_ships_company_{column} 未建立，'
+              '请在船舶配置页删除重复的船舶', file=sys.stderr)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS report_templates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            company_id INTEGER,
+            report_type TEXT,
+            fields TEXT,
+            FOREIGN KEY (company_id) REFERENCES companies(id)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ship_id INTEGER,
+            report_type TEXT,
+            data TEXT,
+            status TEXT, -- 保存状态：saved, submitted
+            FOREIGN KEY (ship_id) REFERENCES ships(id)
+        )
+    ''')
+    # 报告创建时间，以及离线同步用的幂等键（重复上传不会产生重复报告）
+    add_column(c, 'reports', 'created_at', 'TEXT')
+    add_column(c, 'reports', 'idempotency_key', 'TEXT')
+    c.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_reports_idempotency_key ON reports (idempotency_key)')
+    add_column(c, 'reports', 'submitted_at', 'TEXT')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS admins (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE,
+            password BLOB
+        )
+    ''')
+
+    # 平台概览的物化汇总表，由 admin_summary.refresh_summaries 增量刷新
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS summary_pending (
+            report_id INTEGER PRIMARY KEY -- 已提交但尚未计入汇总的报告
+        )
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_reports_submitted_insert AFTER INSERT ON reports
+        WHEN NEW.status = 'submitted'
+        BEGIN
+            INSERT OR IGNORE INTO summary_pending (report_id) VALUES (NEW.id);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_reports_submitted_update AFTER UPDATE OF status ON reports
+        WHEN NEW.status = 'submitted' AND OLD.status IS NOT 'submitted'
+        BEGIN
+            INSERT OR IGNORE INTO summary_pending (report_id) VALUES (NEW.id);
+        END
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS summary_companies (
+            company_id INTEGER PRIMARY KEY,
+            company_name TEXT,
+            ship_count INTEGER DEFAULT 0,
+            report_count INTEGER DEFAULT 0,
+            latency_seconds REAL DEFAULT 0, -- 填报到提交耗时之和
+            latency_count INTEGER DEFAULT 0,
+            last_report_at TEXT
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS summary_daily (
+            company_id INTEGER,
+            day TEXT,
+            report_count INTEGER DEFAULT 0,
+            PRIMARY KEY (company_id, day)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_summary_daily_day ON summary_daily (day)')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS summary_vessels (
+            ship_id INTEGER PRIMARY KEY,
+            company_id INTEGER,
+            ship_name TEXT,
+            last_report_type TEXT,
+            last_report_at TEXT
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_summary_vessels_last_report_at ON summary_vessels (last_report_at)')
+    # 已计入汇总的报告及其贡献，报告撤回、删除或船舶删除时据此从汇总中减去
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS summary_counted (
+            report_id INTEGER PRIMARY KEY,
+            ship_id INTEGER,
+            company_id INTEGER,
+            report_type TEXT,
+            report_at TEXT,
+            latency_seconds REAL
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_summary_counted_ship ON summary_counted (ship_id, report_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_summary_counted_company ON summary_counted (company_id, report_at)')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS summary_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+    # 船位时间序列，按 (船舶, 时间, 报告) 聚簇存放；首次建表时从历史报告回填
+    # 旧版本以 (船舶, 时间) 为主键，同一时刻的多份报告只保留了一条船位，删除后按新主键重新回填
+    position_columns = {row[1]: row[5] for row in c.execute('PRAGMA table_info(ship_positions)')}
+    positions_rebuilt = bool(position_columns) and not position_columns.get('report_id')
+    if positions_rebuilt:
+        c.execute('DROP TABLE ship_positions')
+        position_columns = {}
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ship_positions (
+            ship_id INTEGER,
+            ts TEXT,
+            lat REAL,
+            lon REAL,
+            report_id INTEGER,
+            PRIMARY KEY (ship_id, ts, report_id)
+        ) WITHOUT ROWID
+    ''')
+    if not position_columns:
+        backfill_positions(c)
+
+    # 报告变更日志（只追加），记录提交、修改和删除，序号单调递增，供增量刷新和外部订阅
+    events_exist = c.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'report_events'"
+    ).fetchone()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS report_events (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            event TEXT, -- submitted, amended, deleted
+            report_id INTEGER,
+            ship_id INTEGER,
+            company_id INTEGER,
+            report_type TEXT,
+            data TEXT,
+            created_at TEXT
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_report_events_company_seq ON report_events (company_id, seq)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_report_events_ship_seq ON report_events (ship_id, seq)')
+    if not events_exist:
+        # 首次建表时把已提交的历史报告按顺序记为提交事件
+        c.execute('''
+            INSERT INTO report_events (event, report_id, ship_id, company_id, report_type, data, created_at)
+            SELECT 'submitted', reports.id, reports.ship_id, ships.company_id, reports.report_type, reports.data,
+                   COALESCE(reports.submitted_at, reports.created_at)
+            FROM reports LEFT JOIN ships ON ships.id = reports.ship_id
+            WHERE reports.status = 'submitted'
+            ORDER BY reports.id
+        ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_report_events_insert AFTER INSERT ON reports
+        WHEN NEW.status = 'submitted'
+        BEGIN
+            INSERT INTO report_events (event, report_id, ship_id, company_id, report_type, data, created_at)
+            VALUES ('submitted', NEW.id, NEW.ship_id, (SELECT company_id FROM ships WHERE id = NEW.ship_id),
+                    NEW.report_type, NEW.data, strftime('%Y-%m-%dT%H:%M:%S', 'now', 'localtime'));
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_report_events_update AFTER UPDATE ON reports
+        WHEN (NEW.status = 'submitted'
+              AND (OLD.status IS NOT 'submitted' OR OLD.data IS NOT NEW.data OR OLD.report_type IS NOT NEW.report_type))
+             OR (OLD.status = 'submitted' AND NEW.status IS NOT 'submitted')
+        BEGIN
+            -- 已提交的报告被撤回时记为删除
+            INSERT INTO report_events (event, report_id, ship_id, company_id, report_type, data, created_at)
+            VALUES (CASE WHEN NEW.status IS NOT 'submitted' THEN 'deleted'
+                         WHEN OLD.status IS 'submitted' THEN 'amended'
+                         ELSE 'submitted' END,
+                    NEW.id, NEW.ship_id, (SELECT company_id FROM ships WHERE id = NEW.ship_id), NEW.report_type,
+                    CASE WHEN NEW.status = 'submitted' THEN NEW.data END,
+                    strftime('%Y-%m-%dT%H:%M:%S', 'now', 'localtime'));
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_report_events_delete AFTER DELETE ON reports
+        WHEN OLD.status = 'submitted'
+        BEGIN
+            INSERT INTO report_events (event, report_id, ship_id, company_id, report_type, data, created_at)
+            VALUES ('deleted', OLD.id, OLD.ship_id, (SELECT company_id FROM ships WHERE id = OLD.ship_id),
+                    OLD.report_type, NULL, strftime('%Y-%m-%dT%H:%M:%S', 'now', 'localtime'));
+        END
+    ''')
+    # 报告船位所在的排放控制区和港区（见 geofence.py），区域集合变化时按指纹整体重算
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS report_zones (
+            report_id INTEGER,
+            zone TEXT,
+            kind TEXT, -- ECA, SECA, PORT
+            PRIMARY KEY (report_id, zone)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_report_zones_zone ON report_zones (zone)')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS geofence_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+    if positions_rebuilt:
+        # 船位重新回填后，下次启动时按全部船位重算所在区域
+        c.execute("DELETE FROM geofence_state WHERE key = 'fingerprint'")
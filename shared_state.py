@@ -0,0 +1,117 @@
+import os
+import time
+import sqlite3
+import secrets
+import threading
+
+# 多进程部署时各应用进程共享的状态，保存在一个小型 SQLite 文件中：
+#   sessions       登录会话令牌，应用进程重启或客户端被转发到其他进程时据此恢复登录状态；
+#                  令牌绑定客户端特征，每次恢复后换发新令牌
+#   invalidations  缓存失效事件，各进程轮询后使本地查询缓存失效
+class SharedState:
+    def __init__(self, path, session_ttl=12 * 3600):
+        self.path = path
+        self.session_ttl = session_ttl
+        # 本进程标识，轮询时跳过自己发布的事件
+        self.origin = f'{os.getpid()}-{secrets.token_hex(4)}'
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                token TEXT PRIMARY KEY,
+                kind TEXT, -- company, admin
+                principal_id INTEGER,
+                binding TEXT, -- 客户端特征的摘要，见 streamlit_app.client_binding
+                expires_at REAL
+            )
+        ''')
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(sessions)')]
+        if 'binding' not in columns:
+            # 旧版本的会话未绑定客户端，无法校验，全部作废
+            conn.execute('ALTER TABLE sessions ADD COLUMN binding TEXT')
+            conn.execute('DELETE FROM sessions')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS invalidations (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                company_id INTEGER,
+                origin TEXT,
+                created_at REAL
+            )
+        ''')
+        conn.commit()
+
+    # 每个线程使用自己的连接
+    def _conn(self):
+        if not hasattr(self._local, 'conn'):
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            self._local.conn = conn
+        return self._local.conn
+
+    def create_session(self, kind, principal_id, binding):
+        token = secrets.token_urlsafe(32)
+        conn = self._conn()
+        conn.execute('INSERT INTO sessions (token, kind, principal_id, binding, expires_at) VALUES (?, ?, ?, ?, ?)',
+                     (token, kind, principal_id, binding, time.time() + self.session_ttl))
+        conn.commit()
+        self.prune()
+        return token
+
+    # 用令牌恢复会话并换发新令牌，旧令牌立即失效（同一令牌只能恢复一次），会话的过期时间不变。
+    # 返回 (kind, principal_id, 新令牌)；令牌无效、已过期或与客户端特征不符时返回 None
+    def rotate_session(self, token, binding):
+        conn = self._conn()
+        with conn:
+            rows = conn.execute(
+                '''DELETE FROM sessions WHERE token = ? AND binding = ? AND expires_at >= ?
+                   RETURNING kind, principal_id, expires_at''',
+                (token, binding, time.time())
+            ).fetchall()
+            if not rows:
+                return None
+            kind, principal_id, expires_at = rows[0]
+            new_token = secrets.token_urlsafe(32)
+            conn.execute('INSERT INTO sessions (token, kind, principal_id, binding, expires_at) VALUES (?, ?, ?, ?, ?)',
+                         (new_token, kind, principal_id, binding, expires_at))
+        return kind, principal_id, new_token
+
+    def delete_session(self, token):
+        conn = self._conn()
+        conn.execute('DELETE FROM sessions WHERE token = ?', (token,))
+        conn.commit()
+
+    def publish_invalidation(self, company_id):
+        conn = self._conn()
+        conn.execute('INSERT INTO invalidations (company_id, origin, created_at) VALUES (?, ?, ?)',
+                     (company_id, self.origin, time.time()))
+        conn.commit()
+
+    def last_seq(self):
+        return self._conn().execute('SELECT COALESCE(MAX(seq), 0) FROM invalidations').fetchone()[0]
+
+    # 返回 (最新序号, 其他进程发布的失效公司ID列表)；
+    # 若 since 之后的事件已被清理，无法确定哪些公司失效，公司列表返回 None
+    def poll_invalidations(self, since):
+        conn = self._conn()
+        rows = conn.execute(
+            'SELECT seq, company_id, origin FROM invalidations WHERE seq > ? ORDER BY seq',
+            (since,)
+        ).fetchall()
+        first_seq = rows[0][0] if rows else None
+        if first_seq != since + 1:
+            # 序号不连续时检查是否有事件已被清理
+            latest = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'invalidations'").fetchone()
+            latest = latest[0] if latest else 0
+            if latest > since and (first_seq is None or first_seq > since + 1):
+                return latest, None
+        if not rows:
+            return since, []
+        return rows[-1][0], [row[1] for row in rows if row[2] != self.origin]
+
+    # 清理过期的失效事件，保留最近 max_age 秒
+    def prune(self, max_age=3600):
+        conn = self._conn()
+        conn.execute('DELETE FROM invalidations WHERE created_at < ?', (time.time() - max_age,))
+        conn.execute('DELETE FROM sessions WHERE expires_at < ?', (time.time(),))
+        conn.commit()
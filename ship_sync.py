@@ -0,0 +1,330 @@
+import sqlite3
+import struct
+import zlib
+import uuid
+import time
+import json
+import base64
+import argparse
+import urllib.request
+import urllib.error
+from datetime import datetime
+
+from track_store import record_position
+from report_formulas import field_names
+from geofence import tag_report
+
+# 离线存储转发：船端先把报告写入本地发件箱，再按批次压缩上传到岸基服务器。
+# 批次格式：魔数 b'ST' + 版本号 + zlib 压缩的正文；
+# 正文：报告数量，随后每份报告依次为
+#   幂等键(16字节) 船舶ID 模板ID 创建时间(Unix秒) 模板字段CRC32(4字节) 字段数 [字段值长度 字段值]...
+# 字段名不上传，双方都按模板字段顺序还原。
+MAGIC = b'ST'
+VERSION = 1
+
+
+# 无符号变长整数编码
+def write_varint(buf, value):
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            buf.append(byte | 0x80)
+        else:
+            buf.append(byte)
+            return
+
+
+def read_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+# 模板字段校验值，用于发现船端与岸端模板不一致
+def fields_checksum(fields):
+    return zlib.crc32(','.join(fields).encode())
+
+
+# 将报告列表编码为压缩批次
+# 每份报告为字典：key(16字节), ship_id, template_id, created_at, checksum, values(按模板字段顺序)
+def encode_batch(reports):
+    body = bytearray()
+    write_varint(body, len(reports))
+    for report in reports:
+        body += report['key']
+        write_varint(body, report['ship_id'])
+        write_varint(body, report['template_id'])
+        write_varint(body, report['created_at'])
+        body += struct.pack('>I', report['checksum'])
+        write_varint(body, len(report['values']))
+        for value in report['values']:
+            raw = value.encode()
+            write_varint(body, len(raw))
+            body += raw
+    return MAGIC + bytes([VERSION]) + zlib.compress(bytes(body), 9)
+
+
+# 解压后正文的大小上限，防止小批次解压出超大数据
+MAX_BODY_SIZE = 16 * 1024 * 1024
+KEY_SIZE = 16
+
+
+# 解析批次，格式错误（压缩数据损坏、内容被截断、幂等键长度不对等）统一抛出 ValueError
+def decode_batch(payload):
+    if payload[:2] != MAGIC or payload[2:3] != bytes([VERSION]):
+        raise ValueError('无法识别的批次格式')
+    decompressor = zlib.decompressobj()
+    try:
+        data = decompressor.decompress(payload[3:], MAX_BODY_SIZE)
+    except zlib.error as e:
+        raise ValueError(f'批次数据损坏：{e}')
+    if decompressor.unconsumed_tail:
+        raise ValueError(f'批次解压后超过 {MAX_BODY_SIZE} 字节')
+    if not decompressor.eof:
+        raise ValueError('批次数据不完整')
+    try:
+        return _decode_body(data)
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f'批次内容不完整：{e}')
+
+
+def _decode_body(data):
+    count, pos = read_varint(data, 0)
+    reports = []
+    for _ in range(count):
+        key = data[pos:pos + KEY_SIZE]
+        if len(key) != KEY_SIZE:
+            raise ValueError('幂等键长度不正确')
+        pos += KEY_SIZE
+        ship_id, pos = read_varint(data, pos)
+        template_id, pos = read_varint(data, pos)
+        created_at, pos = read_varint(data, pos)
+        checksum = struct.unpack('>I', data[pos:pos + 4])[0]
+        pos += 4
+        n, pos = read_varint(data, pos)
+        values = []
+        for _ in range(n):
+            length, pos = read_varint(data, pos)
+            if pos + length > len(data):
+                raise ValueError('字段值被截断')
+            values.append(data[pos:pos + length].decode())
+            pos += length
+        reports.append({
+            'key': key, 'ship_id': ship_id, 'template_id': template_id,
+            'created_at': created_at, 'checksum': checksum, 'values': values,
+        })
+    return reports
+
+
+# 模板与岸端不一致等导致整批无法入库的错误，key 为出错报告的幂等键
+class BatchRejected(Exception):
+    def __init__(self, key, message):
+        super().__init__(message)
+        self.key = key
+
+
+# 岸端：在一个事务中写入整批报告，已存在的幂等键直接忽略
+# 返回 (新写入数量, 重复数量)；任何一份报告校验失败则整批回滚
+# zones 为 geofence.ZoneIndex，传入时同时记录报告船位所在的区域
+def apply_batch(c, company_id, reports, zones=None):
+    ships = {row[0] for row in c.execute('SELECT id FROM ships WHERE company_id = ?', (company_id,)).fetchall()}
+    templates = {
+        row[0]: (row[1], field_names(row[2]))
+        for row in c.execute('SELECT id, report_type, fields FROM report_templates WHERE company_id = ?', (company_id,)).fetchall()
+    }
+    # 岸端收到批次的时间作为提交时间
+    submitted_at = datetime.now().isoformat(timespec='seconds')
+    inserted = 0
+    for report in reports:
+        key = report['key']
+        if report['ship_id'] not in ships:
+            raise BatchRejected(key, f"船舶 {report['ship_id']} 不属于该公司")
+        if report['template_id'] not in templates:
+            raise BatchRejected(key, f"报告模板 {report['template_id']} 不存在")
+        report_type, fields = templates[report['template_id']]
+        if fields_checksum(fields) != report['checksum'] or len(fields) != len(report['values']):
+            raise BatchRejected(key, f'报告模板 {report_type} 已变更，请重新同步模板')
+        data = dict(zip(fields, report['values']))
+        created_at = datetime.fromtimestamp(report['created_at']).isoformat(timespec='seconds')
+        c.execute(
+            '''INSERT OR IGNORE INTO reports (ship_id, report_type, data, status, created_at, submitted_at, idempotency_key)
+               VALUES (?, ?, ?, ?, ?, ?, ?)''',
+            (report['ship_id'], report_type, str(data), 'submitted', created_at, submitted_at, str(uuid.UUID(bytes=key)))
+        )
+        if c.rowcount:
+            report_id = c.lastrowid
+            inserted += 1
+            # 船位时间取船端填报时间
+            record_position(c, report_id, report['ship_id'], data, created_at)
+            if zones is not None:
+                tag_report(c, zones, report_id, data)
+    return inserted, len(reports) - inserted
+
+
+# 船端本地发件箱
+class Outbox:
+    def __init__(self, path='outbox.db'):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS templates (
+                id INTEGER PRIMARY KEY,
+                report_type TEXT,
+                fields TEXT
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS ships (
+                id INTEGER PRIMARY KEY,
+                ship_name TEXT
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key BLOB UNIQUE,
+                ship_id INTEGER,
+                template_id INTEGER,
+                created_at INTEGER,
+                checksum INTEGER,
+                data_values TEXT, -- JSON 数组，按模板字段顺序
+                status TEXT DEFAULT 'queued', -- queued, rejected
+                error TEXT
+            )
+        ''')
+        self.conn.commit()
+
+    # 保存岸端下发的船舶和模板信息，离线时据此填报
+    def store_reference(self, reference):
+        self.conn.execute('DELETE FROM ships')
+        self.conn.execute('DELETE FROM templates')
+        self.conn.executemany('INSERT INTO ships (id, ship_name) VALUES (?, ?)',
+                              [(s['id'], s['ship_name']) for s in reference['ships']])
+        self.conn.executemany('INSERT INTO templates (id, report_type, fields) VALUES (?, ?, ?)',
+                              [(t['id'], t['report_type'], t['fields']) for t in reference['templates']])
+        self.conn.commit()
+
+    # 报告入队，values 为 {字段: 值}
+    def queue_report(self, ship_id, template_id, values):
+        row = self.conn.execute('SELECT fields FROM templates WHERE id = ?', (template_id,)).fetchone()
+        if not row:
+            raise ValueError(f'未找到报告模板 {template_id}，请先同步模板')
+        fields = field_names(row[0])
+        key = uuid.uuid4().bytes
+        self.conn.execute(
+            'INSERT INTO outbox (idempotency_key, ship_id, template_id, created_at, checksum, data_values) VALUES (?, ?, ?, ?, ?, ?)',
+            (key, ship_id, template_id, int(time.time()), fields_checksum(fields),
+             json.dumps([values.get(field, '') for field in fields], ensure_ascii=False))
+        )
+        self.conn.commit()
+        return key
+
+    def pending(self, limit):
+        rows = self.conn.execute(
+            '''SELECT idempotency_key, ship_id, template_id, created_at, checksum, data_values
+               FROM outbox WHERE status = 'queued' ORDER BY seq LIMIT ?''',
+            (limit,)
+        ).fetchall()
+        return [{
+            'key': row[0], 'ship_id': row[1], 'template_id': row[2],
+            'created_at': row[3], 'checksum': row[4], 'values': json.loads(row[5]),
+        } for row in rows]
+
+    # 岸端确认后删除整批
+    def acknowledge(self, keys):
+        self.conn.executemany('DELETE FROM outbox WHERE idempotency_key = ?', [(k,) for k in keys])
+        self.conn.commit()
+
+    def reject(self, key, error):
+        self.conn.execute("UPDATE outbox SET status = 'rejected', error = ? WHERE idempotency_key = ?", (error, key))
+        self.conn.commit()
+
+
+# 与岸端服务器通信的客户端
+class SyncClient:
+    def __init__(self, server_url, company_name, password, timeout=30):
+        self.server_url = server_url.rstrip('/')
+        self.timeout = timeout
+        token = base64.b64encode(f'{company_name}:{password}'.encode()).decode()
+        self.headers = {'Authorization': f'Basic {token}'}
+
+    def _request(self, path, body=None, content_type=None):
+        headers = dict(self.headers)
+        if content_type:
+            headers['Content-Type'] = content_type
+        request = urllib.request.Request(self.server_url + path, data=body, headers=headers,
+                                         method='POST' if body is not None else 'GET')
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def fetch_reference(self):
+        return self._request('/sync/reference')
+
+    # 上传发件箱中所有待发报告，网络失败时按指数退避重试
+    # 同一批次可能重复上传，岸端依靠幂等键去重
+    def push(self, outbox, batch_size=50, max_retries=8, backoff=1.0):
+        sent = 0
+        while True:
+            reports = outbox.pending(batch_size)
+            if not reports:
+                return sent
+            payload = encode_batch(reports)
+            for attempt in range(max_retries):
+                try:
+                    result = self._request('/sync/batch', payload, 'application/octet-stream')
+                    break
+                except urllib.error.HTTPError as e:
+                    if e.code == 422:
+                        # 某份报告被岸端拒绝，标记后重新组批
+                        error = json.loads(e.read())
+                        outbox.reject(bytes.fromhex(error['key']), error['error'])
+                        result = None
+                        break
+                    if attempt == max_retries - 1:
+                        raise
+                except (urllib.error.URLError, ConnectionError, TimeoutError):
+                    if attempt == max_retries - 1:
+                        raise
+                time.sleep(backoff * 2 ** attempt)
+            if result is not None:
+                outbox.acknowledge([r['key'] for r in reports])
+                sent += len(reports)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='船端离线报告同步')
+    parser.add_argument('--outbox', default='outbox.db')
+    parser.add_argument('--server', default='http://localhost:8600')
+    parser.add_argument('--company', required=True)
+    parser.add_argument('--password', required=True)
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('pull', help='下载船舶和报告模板')
+    queue_parser = sub.add_parser('queue', help='报告入队，字段格式为 字段=值')
+    queue_parser.add_argument('--ship-id', type=int, required=True)
+    queue_parser.add_argument('--template-id', type=int, required=True)
+    queue_parser.add_argument('values', nargs='*')
+    push_parser = sub.add_parser('push', help='上传待发报告')
+    push_parser.add_argument('--batch-size', type=int, default=50)
+    args = parser.parse_args()
+
+    outbox = Outbox(args.outbox)
+    client = SyncClient(args.server, args.company, args.password)
+    if args.command == 'pull':
+        outbox.store_reference(client.fetch_reference())
+        print('模板已同步')
+    elif args.command == 'queue':
+        values = dict(v.split('=', 1) for v in args.values)
+        key = outbox.queue_report(args.ship_id, args.template_id, values)
+        print(f'报告已入队：{uuid.UUID(bytes=key)}')
+    elif args.command == 'push':
+        print(f'已上传 {client.push(outbox, args.batch_size)} 份报告')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,11 +2,27 @@ import streamlit as st
 import sqlite3
 import bcrypt
 import pandas as pd
+import pydeck as pdk
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime
 import time
+import os
+import hashlib
+
+from db_writer import DBWriter
+from schema import init_db, create_ship_indexes
+from anomaly import AnomalyDetector, rescan_fleet
+from query_cache import QueryCache
+from shared_state import SharedState
+from admin_summary import SummaryRefresher, load_overview
+from track_store import record_position, load_track
+from change_feed import latest_seq, read_events, apply_events
+from fleet_import import COLUMNS as FLEET_COLUMNS, read_fleet_file, validate_fleet, insert_fleet, duplicate_ships
+from backup import BackupScheduler
+from report_formulas import FormulaEngine, previous_values
+from geofence import load_zone_index, sync_history, tag_report
 
 import streamlit as st
 
@@ -27,51 +43,82 @@ st.markdown(
 )
 
 # 设置数据库连接
-conn = sqlite3.connect('shipping_system.db')
+DB_PATH = os.environ.get('SHIPTALK_DB', 'shipping_system.db')
+# fragment（报告查阅的定时刷新、报告填报表单）的重跑在新的脚本线程中执行，但沿用上次整页重跑创建的连接；
+# 同一会话的重跑不会并发执行，因此允许跨线程使用
+conn = sqlite3.connect(DB_PATH, check_same_thread=False)
 c = conn.cursor()
 
-# 数据库初始化函数
-def init_db():
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS companies (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            company_name TEXT UNIQUE,
-            password BLOB
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS ships (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            company_id INTEGER,
-            ship_name TEXT,
-            imo_number TEXT,
-            mmsi TEXT,
-            FOREIGN KEY (company_id) REFERENCES companies(id)
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS report_templates (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            company_id INTEGER,
-            report_type TEXT,
-            fields TEXT,
-            FOREIGN KEY (company_id) REFERENCES companies(id)
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS reports (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ship_id INTEGER,
-            report_type TEXT,
-            data TEXT,
-            status TEXT, -- 保存状态：saved, submitted
-            FOREIGN KEY (ship_id) REFERENCES ships(id)
-        )
-    ''')
-    conn.commit()
+# 单写线程：进程内所有会话共享，写操作统一经由队列批量提交
+@st.cache_resource
+def get_writer():
+    return DBWriter(DB_PATH)
+
+writer = get_writer()
+
+# 多进程部署模式：设置 SHIPTALK_SHARED_STATE 后，登录会话和缓存失效事件经共享存储在进程间同步
+SHARED_STATE_PATH = os.environ.get('SHIPTALK_SHARED_STATE')
+
+@st.cache_resource
+def get_shared_state():
+    return SharedState(SHARED_STATE_PATH) if SHARED_STATE_PATH else None
+
+shared_state = get_shared_state()
+
+# 船舶、报告模板查询缓存，所有会话共享，写入后按公司失效
+@st.cache_resource
+def get_query_cache():
+    return QueryCache(shared=shared_state)
+
+query_cache = get_query_cache()
+
+# 平台概览汇总表的定时增量刷新
+@st.cache_resource
+def get_summary_refresher():
+    return SummaryRefresher(writer)
+
+summary_refresher = get_summary_refresher()
 
-# 初始化数据库
-init_db()
+# 定时在线备份：设置 SHIPTALK_BACKUP_DIR 后启用，在写线程中分步复制，不阻塞前台写入
+BACKUP_DIR = os.environ.get('SHIPTALK_BACKUP_DIR')
+
+@st.cache_resource
+def get_backup_scheduler():
+    if not BACKUP_DIR:
+        return None
+    return BackupScheduler(
+        writer, BACKUP_DIR,
+        interval=float(os.environ.get('SHIPTALK_BACKUP_INTERVAL_HOURS', '6')) * 3600,
+        keep=int(os.environ.get('SHIPTALK_BACKUP_KEEP', '14')),
+    )
+
+backup_scheduler = get_backup_scheduler()
+
+# 油耗、航速异常检测器，进程内共享各船的滚动统计
+@st.cache_resource
+def get_anomaly_detector():
+    return AnomalyDetector()
+
+# 报告模板编译后的派生字段依赖图，按模板文本缓存，所有会话共享
+@st.cache_resource
+def get_formula_engine(fields):
+    return FormulaEngine(fields)
+
+# 初始化数据库，每个进程执行一次，不随页面重跑重复执行
+@st.cache_resource
+def init_database():
+    writer.transaction(init_db).result()
+
+init_database()
+
+# 排放控制区与港区索引；区域集合变化（或首次启动）时在写线程中重算历史船位
+@st.cache_resource
+def get_zone_index():
+    index = load_zone_index()
+    writer.transaction(lambda cur: sync_history(cur, index)).result()
+    return index
+
+zone_index = get_zone_index()
 
 
 # 用户注册功能
@@ -93,12 +140,48 @@ def register_company():
         # 加密密码并存储
         hashed_pw = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
         try:
-            c.execute('INSERT INTO companies (company_name, password) VALUES (?, ?)', (company_name, hashed_pw))
-            conn.commit()
+            writer.execute('INSERT INTO companies (company_name, password) VALUES (?, ?)', (company_name, hashed_pw)).result()
             st.success('注册成功！')
         except sqlite3.IntegrityError:
             st.error('公司名称已存在。')
 
+# 多进程模式下把登录会话写入共享存储，令牌放在页面地址中，
+# 应用进程重启或客户端被转发到其他进程时据此恢复登录状态。
+# 令牌绑定客户端特征，复制页面地址到其他设备无法登录；每次恢复后换发新令牌，旧地址随即失效
+def client_binding():
+    headers = st.context.headers
+    # X-Real-IP 由反向代理按连接的对端地址设置，客户端无法伪造
+    raw = f"{headers.get('User-Agent', '')}\0{headers.get('X-Real-IP', '')}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+def remember_session(kind, principal_id):
+    if shared_state:
+        st.query_params['session'] = shared_state.create_session(kind, principal_id, client_binding())
+
+def restore_session():
+    token = st.query_params.get('session')
+    if not shared_state or not token:
+        return
+    if st.session_state.get('logged_in') or st.session_state.get('admin_logged_in'):
+        return
+    session = shared_state.rotate_session(token, client_binding())
+    if session is None:
+        del st.query_params['session']
+        return
+    kind, principal_id, token = session
+    st.query_params['session'] = token
+    if kind == 'company':
+        st.session_state['logged_in'] = True
+        st.session_state['company_id'] = principal_id
+    elif kind == 'admin':
+        st.session_state['admin_logged_in'] = True
+
+def forget_session():
+    token = st.query_params.get('session')
+    if shared_state and token:
+        shared_state.delete_session(token)
+        del st.query_params['session']
+
 # 用户登录功能
 def login():
     st.subheader('登录')
@@ -111,24 +194,107 @@ def login():
         if result and bcrypt.checkpw(password.encode(), result[1]):
             st.session_state['logged_in'] = True
             st.session_state['company_id'] = result[0]
+            remember_session('company', result[0])
             st.success('登录成功！')
             st.rerun()  # 刷新页面         
         else:
             st.error('公司名称或密码错误。')
 
+# 管理员登录功能
+def login_admin():
+    st.subheader('管理员登录')
+    username = st.text_input('用户名')
+    password = st.text_input('密码', type='password')
+
+    if st.button('登录'):
+        c.execute('SELECT id, password FROM admins WHERE username = ?', (username,))
+        result = c.fetchone()
+        if result and bcrypt.checkpw(password.encode(), result[1]):
+            st.session_state['admin_logged_in'] = True
+            remember_session('admin', result[0])
+            st.success('登录成功！')
+            st.rerun()  # 刷新页面
+        else:
+            st.error('用户名或密码错误。')
+
+# 管理员平台概览，只读物化汇总表
+def admin_overview():
+    st.subheader('平台概览')
+    if st.button('立即刷新'):
+        try:
+            summary_refresher.refresh()
+        except Exception:
+            pass
+    if summary_refresher.last_error is not None:
+        st.error(f'汇总刷新失败，以下数据可能已过期：{summary_refresher.last_error}')
+
+    companies, daily, vessels, refreshed_at = load_overview(c)
+    st.caption(f'汇总更新时间：{refreshed_at or "尚未刷新"}')
+
+    st.write('船公司：')
+    df_companies = pd.DataFrame(companies, columns=['公司名称', '船舶数量', '报告数量', '平均提交耗时（分钟）', '最近报告时间'])
+    st.dataframe(df_companies, hide_index=True)
+
+    st.write('近30天每日报告量：')
+    if daily:
+        df_daily = pd.DataFrame(daily, columns=['日期', '公司名称', '报告数量'])
+        st.bar_chart(df_daily.pivot_table(index='日期', columns='公司名称', values='报告数量', fill_value=0))
+    else:
+        st.write('暂无报告。')
+
+    st.write('最近报告的船舶：')
+    df_vessels = pd.DataFrame(vessels, columns=['公司名称', '船舶名称', '报告类型', '报告时间'])
+    st.dataframe(df_vessels, hide_index=True)
+
 # 获取当前公司配置的船舶
 def get_ships():
-    return c.execute(
+    company_id = st.session_state['company_id']
+    return query_cache.get(company_id, 'ships', lambda: c.execute(
         'SELECT id, ship_name, imo_number, mmsi FROM ships WHERE company_id = ?',
-        (st.session_state['company_id'],)
-    ).fetchall()
+        (company_id,)
+    ).fetchall())
 
 # 删除船舶函数
 def delete_ship(ship_id):
-    c.execute('DELETE FROM ships WHERE id = ?', (ship_id,))
-    conn.commit()
-    # 更新 session_state 中的船舶数据
-    st.session_state['ships'] = get_ships()
+    writer.execute('DELETE FROM ships WHERE id = ?', (ship_id,)).result()
+    # 旧数据中的重复船舶删除后，补建之前未能建立的唯一索引
+    writer.transaction(create_ship_indexes).result()
+    # 使船舶缓存失效
+    query_cache.invalidate(st.session_state['company_id'])
+
+# 批量导入船队：校验全部通过后在一个事务中写入
+def import_fleet():
+    with st.expander('批量导入船舶（CSV / Excel）'):
+        st.caption('文件需包含列：船舶名称、IMO编号、MMSI')
+        uploaded = st.file_uploader('选择文件', type=['csv', 'xlsx'], key=f"fleet_file_{st.session_state.get('fleet_imports', 0)}")
+        if uploaded is None:
+            return
+        try:
+            fleet = read_fleet_file(uploaded, uploaded.name)
+        except ValueError as e:
+            st.error(f'文件读取失败：{e}')
+            return
+        errors = validate_fleet(fleet, [s[1:] for s in get_ships()])
+        invalid = [i for i, row_errors in enumerate(errors) if row_errors]
+        if invalid:
+            st.error(f'{len(invalid)} 行数据有误，请修正后重新上传（整批不会导入）。')
+            report = fleet.iloc[invalid].copy()
+            report.insert(0, '行号', [i + 2 for i in invalid])  # 含表头的文件行号
+            report['错误'] = ['；'.join(errors[i]) for i in invalid]
+            st.dataframe(report, hide_index=True)
+            return
+        st.dataframe(fleet, hide_index=True)
+        if st.button(f'导入 {len(fleet)} 艘船舶'):
+            company_id = st.session_state['company_id']
+            try:
+                count = writer.transaction(lambda cur: insert_fleet(cur, company_id, fleet)).result()
+            except sqlite3.IntegrityError:
+                st.error('IMO编号或MMSI与已有船舶重复，整批未导入。')
+                return
+            query_cache.invalidate(company_id)
+            # 更换上传控件的 key，下次刷新时清空已导入的文件
+            st.session_state['fleet_imports'] = st.session_state.get('fleet_imports', 0) + 1
+            st.success(f'已导入 {count} 艘船舶。')
 
 # 船舶配置功能
 def configure_ships():
@@ -141,23 +307,35 @@ def configure_ships():
         if not ship_name or not imo_number or not mmsi:
             st.error('请填写所有船舶信息。')
             return
+        # 与批量导入使用相同的校验
+        new_ship = pd.DataFrame([(ship_name, imo_number, mmsi)], columns=FLEET_COLUMNS)
+        errors = validate_fleet(new_ship, [s[1:] for s in get_ships()])[0]
+        if errors:
+            st.error('；'.join(errors))
+            return
         # 添加新船舶到数据库
-        c.execute('INSERT INTO ships (company_id, ship_name, imo_number, mmsi) VALUES (?, ?, ?, ?)',
-                  (st.session_state['company_id'], ship_name, imo_number, mmsi))
-        conn.commit()
+        company_id = st.session_state['company_id']
+        try:
+            writer.transaction(lambda cur: insert_fleet(cur, company_id, new_ship)).result()
+        except sqlite3.IntegrityError:
+            st.error('IMO编号或MMSI与已有船舶重复。')
+            return
+        query_cache.invalidate(company_id)
         st.success('船舶添加成功！')
-        # 更新船舶列表
-        st.session_state['ships'] = get_ships()
 
-    # 初始化船舶数据到 session_state
-    if 'ships' not in st.session_state:
-        st.session_state['ships'] = get_ships()
+    import_fleet()
+
+    ships = get_ships()
+    duplicates = duplicate_ships(ships)
+    if len(duplicates):
+        st.warning('以下船舶的IMO编号或MMSI重复，数据库唯一约束尚未生效，请删除重复的船舶：')
+        st.dataframe(duplicates, hide_index=True)
 
     # 显示当前公司配置的船舶
     st.write('已配置船舶：')
     
         # 显示船舶列表和删除按钮
-    for index, row in enumerate(st.session_state['ships']):
+    for index, row in enumerate(ships):
         col1, col2, col3, col4, col5 = st.columns([1, 2, 2, 2, 1])
         with col1:
             st.write(row[0])  # ID
@@ -184,8 +362,8 @@ def configure_ships():
 
 
     # 如果删除后仍然存在船舶，显示表格
-    if st.session_state['ships']:
-        df_ships = pd.DataFrame(st.session_state['ships'], columns=['ID', '船舶名称', 'IMO编号', 'MMSI'])
+    if ships:
+        df_ships = pd.DataFrame(ships, columns=['ID', '船舶名称', 'IMO编号', 'MMSI'])
         st.table(df_ships)
     else:
         st.write("没有配置船舶。")
@@ -193,45 +371,53 @@ def configure_ships():
 
 # 获取当前公司配置的报告模板
 def get_templates():
-    return c.execute(
+    company_id = st.session_state['company_id']
+    return query_cache.get(company_id, 'templates', lambda: c.execute(
         'SELECT id, report_type, fields FROM report_templates WHERE company_id = ?',
-        (st.session_state['company_id'],)
-    ).fetchall()
+        (company_id,)
+    ).fetchall())
 
 # 删除报告模板函数
 def delete_template(template_id):
-    c.execute('DELETE FROM report_templates WHERE id = ?', (template_id,))
-    conn.commit()
-    # 更新 session_state 中的模板数据
-    st.session_state['templates'] = get_templates()
+    writer.execute('DELETE FROM report_templates WHERE id = ?', (template_id,)).result()
+    # 使模板缓存失效
+    query_cache.invalidate(st.session_state['company_id'])
 
 
 # 报告模板配置功能
 def configure_report_templates():
     st.subheader('报告模板配置')
     report_type = st.selectbox('报告类型', ['早报', '午报', '晚报', '离港报', '抵港报', '航次报'])
-    fields = st.text_area('报告字段（用逗号分隔）', '航次编号,填报日期,船舶位置,平均航速,24小时耗油量,船舶燃油存量,24小时航行里程,剩余航行里程,预计抵港时间,始发港,目的港')
+    fields = st.text_area(
+        '报告字段（用逗号分隔）',
+        '航次编号=上次.航次编号,填报日期,船舶位置,平均航速,24小时耗油量,船舶燃油存量=上次.船舶燃油存量-24小时耗油量,'
+        '24小时航行里程,剩余航行里程=上次.剩余航行里程-24小时航行里程,预计抵港时间,始发港=上次.始发港,目的港=上次.目的港'
+    )
+    st.caption('字段可写成"名称=公式"，填报时自动计算：公式支持 + - * / 和括号，"上次.字段"取本船上一份已提交报告中的值；'
+               '公式只引用一个字段时直接沿用该值。自动计算的值仍可手动修改。')
 
     if st.button('配置模板'):
+        # 检查公式能否解析、引用的字段是否存在、有无循环引用
+        try:
+            get_formula_engine(fields)
+        except ValueError as e:
+            st.error(f'模板公式有误：{e}')
+            return
+
        # 检查该报告类型是否已存在
-        existing_template = c.execute(
-            'SELECT id FROM report_templates WHERE company_id = ? AND report_type = ?',
-            (st.session_state['company_id'], report_type)
-        ).fetchone()
+        existing_template = next((t for t in get_templates() if t[1] == report_type), None)
 
         if existing_template:
             # 提示用户确认是否替换
             if st.session_state.get('confirm_replace', False):
                 # 如果用户确认替换，执行更新操作
-                c.execute(
+                writer.execute(
                     'UPDATE report_templates SET fields = ? WHERE id = ?',
                     (fields, existing_template[0])
-                )
-                conn.commit()
+                ).result()
+                query_cache.invalidate(st.session_state['company_id'])
                 st.success('已替换旧的报告模板！')
                 st.session_state.pop('confirm_replace', None)
-                # 刷新模板列表
-                st.session_state['templates'] = get_templates()
                 st.rerun()
             else:
                 # 设置确认状态并提醒用户是否替换
@@ -239,26 +425,21 @@ def configure_report_templates():
                 st.warning(f'报告类型 {report_type} 已经存在。点击配置模板按钮再次确认替换。')
         else:
             # 如果没有冲突，直接插入新的模板
-            c.execute(
+            writer.execute(
                 'INSERT INTO report_templates (company_id, report_type, fields) VALUES (?, ?, ?)',
                 (st.session_state['company_id'], report_type, fields)
-            )
-            conn.commit()
+            ).result()
+            query_cache.invalidate(st.session_state['company_id'])
             st.success('模板配置成功！')
-            # 刷新模板列表
-            st.session_state['templates'] = get_templates()
             st.rerun()
 
-
-    # 初始化模板数据到 session_state
-    if 'templates' not in st.session_state:
-        st.session_state['templates'] = get_templates()
+    templates = get_templates()
 
     # 显示当前公司的报告模板
     st.write('当前已配置的报告模板：')
 
     # 显示模板列表和删除按钮
-    for index, row in enumerate(st.session_state['templates']):
+    for index, row in enumerate(templates):
         # 调整列的比例，确保删除按钮有足够的显示空间
         col1, col2, col3 = st.columns([2, 6, 2])
         with col1:
@@ -280,12 +461,12 @@ def configure_report_templates():
                     st.warning(f'确认删除报告模板 {row[1]} 吗？再次点击按钮确认删除。')
 
     # 检查模板是否成功显示
-    if not st.session_state['templates']:
+    if not templates:
         st.write("没有配置报告模板。")
 
     # 显示删除后的模板列表
-    if st.session_state['templates']:
-        df_templates = pd.DataFrame(st.session_state['templates'], columns=['ID', '报告类型', '报告字段'])
+    if templates:
+        df_templates = pd.DataFrame(templates, columns=['ID', '报告类型', '报告字段'])
         st.table(df_templates.drop(columns=['ID']))  # 隐藏ID列，仅显示报告类型和字段
     else:
         st.write("没有配置报告模板。")
@@ -294,82 +475,148 @@ def configure_report_templates():
 def fill_report():
     st.subheader('报告填报')
     
-    # 选择船舶和报告类型
-    ship_name = st.selectbox(
-        '选择船舶', 
-        [s[0] for s in c.execute('SELECT ship_name FROM ships WHERE company_id = ?', (st.session_state['company_id'],)).fetchall()]
-    )
-    report_type = st.selectbox(
-        '选择报告类型', 
-        [t[0] for t in c.execute('SELECT report_type FROM report_templates WHERE company_id = ?', (st.session_state['company_id'],)).fetchall()]
-    )
-
-    # 获取船舶ID
-    ship_id = c.execute(
-        'SELECT id FROM ships WHERE ship_name = ? AND company_id = ?', 
-        (ship_name, st.session_state['company_id'])
-    ).fetchone()
-    if ship_id:
-        ship_id = ship_id[0]
-    else:
+    # 船舶和模板均从共享缓存读取，重复渲染不再查询数据库
+    ships = get_ships()
+    templates = get_templates()
+
+    # 选择船舶和报告类型（按船舶ID选择，同名船舶以 IMO 编号区分）
+    ship_labels = {s[0]: f'{s[1]}（IMO {s[2]}）' if s[2] else s[1] for s in ships}
+    ship_id = st.selectbox('选择船舶', list(ship_labels), format_func=ship_labels.get)
+    report_type = st.selectbox('选择报告类型', [t[1] for t in templates])
+
+    # 获取船舶名称
+    ship_name = next((s[1] for s in ships if s[0] == ship_id), None)
+    if ship_name is None:
         st.error('未找到船舶ID')
         return
 
-    # 获取报告字段
-    fields = c.execute(
-        'SELECT fields FROM report_templates WHERE report_type = ? AND company_id = ?', 
-        (report_type, st.session_state['company_id'])
-    ).fetchone()
-    if fields:
-        fields = fields[0].split(',')
-    else:
+    # 获取报告字段及派生字段公式
+    template_fields = next((t[2] for t in templates if t[1] == report_type), None)
+    if not template_fields:
         st.error('未找到报告模板字段')
         return
+    try:
+        engine = get_formula_engine(template_fields)
+    except ValueError as e:
+        st.error(f'报告模板公式有误：{e}')
+        return
+
+    report_form(ship_id, ship_name, report_type, template_fields, engine)
+
+
+# 报告填报表单。放在 fragment 中，修改字段时只重跑表单本身，
+# 侧边栏、页面样式、船舶和模板查询等只在整页重跑（进入页面、切换船舶或报告类型）时执行
+@st.fragment
+def report_form(ship_id, ship_name, report_type, template_fields, engine):
+    fields = engine.fields
 
     # 初始化报告数据
     if 'report_data' not in st.session_state:
         st.session_state['report_data'] = {}
+    report_data = st.session_state['report_data']
 
     # 确保所有字段都被初始化
     for field in fields:
-        if field not in st.session_state['report_data']:
-            st.session_state['report_data'][field] = ''  # 初始化为默认空字符串
+        if field not in report_data:
+            report_data[field] = ''  # 初始化为默认空字符串
+
+    # 切换船舶或报告类型（以及提交之后）重新读取上一份报告，计算全部派生字段
+    if st.session_state.get('report_context') != (ship_id, template_fields):
+        st.session_state['report_context'] = (ship_id, template_fields)
+        st.session_state['previous_report'] = previous_values(c, ship_id)
+        # 用户手动改写过的派生字段，不再自动覆盖
+        st.session_state['manual_fields'] = set()
+        for field, value in engine.compute_all(report_data, st.session_state['previous_report']).items():
+            st.session_state[f'report_field_{field}'] = value
+
+    # 填报字段：修改某个字段时只重算依赖它的派生字段
+    def field_changed(field):
+        data = st.session_state['report_data']
+        previous = st.session_state['previous_report']
+        manual = st.session_state['manual_fields']
+        value = st.session_state[f'report_field_{field}']
+        if field in engine.formulas:
+            if value.strip():
+                manual.add(field)
+            else:
+                # 清空派生字段即恢复自动计算
+                manual.discard(field)
+                value = engine.formulas[field](data, previous)
+                st.session_state[f'report_field_{field}'] = value
+        data[field] = value
+        for name, new_value in engine.update(data, previous, field, manual).items():
+            st.session_state[f'report_field_{name}'] = new_value
 
-    # 填报字段
     for field in fields:
-        st.session_state['report_data'][field] = st.text_input(
-            field, value=st.session_state['report_data'][field]
+        key = f'report_field_{field}'
+        if key not in st.session_state:
+            st.session_state[key] = report_data[field]
+        formula = engine.sources.get(field)
+        st.text_input(
+            field, key=key, on_change=field_changed, args=(field,),
+            help=f'自动计算：{formula}（可手动修改，清空后恢复自动计算）' if formula else None
         )
 
+    # 上一份报告中缺少引用值的派生字段留空，提示船员手动填写
+    missing = [
+        f"{name}（缺少{'、'.join(refs)}）"
+        for name, refs in engine.missing_previous(st.session_state['previous_report']).items()
+        if not report_data.get(name)
+    ]
+    if missing:
+        st.warning(f"上一份已提交报告中没有以下派生字段引用的数值，未自动计算，请手动填写：{'；'.join(missing)}")
+
     # 用户输入的收件人邮箱地址
     recipient_email = st.text_input('请输入收件人邮箱地址')
 
-    # 自动保存报告数据
+    # 自动保存报告数据，内容未变化（如只修改了收件人邮箱）时不再写库
+    saved_data = str(st.session_state['report_data'])
     if 'saved_report_id' not in st.session_state:
         # 保存初始报告
-        c.execute(
-            'INSERT INTO reports (ship_id, report_type, data, status) VALUES (?, ?, ?, ?)', 
-            (ship_id, report_type, str(st.session_state['report_data']), 'saved')
-        )
-        conn.commit()
-        st.session_state['saved_report_id'] = c.lastrowid
+        result = writer.execute(
+            'INSERT INTO reports (ship_id, report_type, data, status, created_at) VALUES (?, ?, ?, ?, ?)', 
+            (ship_id, report_type, saved_data, 'saved', datetime.now().isoformat(timespec='seconds'))
+        ).result()
+        st.session_state['saved_report_id'] = result.lastrowid
+        st.session_state['saved_report_data'] = saved_data
+        st.session_state['saved_report_target'] = (ship_id, report_type)
         st.success('报告已自动保存！')
-    else:
-        # 更新已保存的报告
-        c.execute(
-            'UPDATE reports SET data = ? WHERE id = ? AND status = ?', 
-            (str(st.session_state['report_data']), st.session_state['saved_report_id'], 'saved')
-        )
-        conn.commit()
+    elif (st.session_state.get('saved_report_data') != saved_data
+          or st.session_state.get('saved_report_target') != (ship_id, report_type)):
+        # 更新已保存的报告；填报中途切换了船舶或报告类型时草稿随之归属到当前选择
+        writer.execute(
+            'UPDATE reports SET ship_id = ?, report_type = ?, data = ? WHERE id = ? AND status = ?', 
+            (ship_id, report_type, saved_data, st.session_state['saved_report_id'], 'saved')
+        ).result()
+        st.session_state['saved_report_data'] = saved_data
+        st.session_state['saved_report_target'] = (ship_id, report_type)
         st.success('报告内容已更新并自动保存！')
 
+    # 提交前检查油耗、航速是否异常
+    detector = get_anomaly_detector()
+    for warning in detector.score(c, ship_id, st.session_state['report_data']):
+        st.warning(warning)
+
     # 提交报告
     if st.button('提交报告'):
-        c.execute(
-            'UPDATE reports SET status = ? WHERE id = ?', 
-            ('submitted', st.session_state['saved_report_id'])
-        )
-        conn.commit()
+        report_id = st.session_state['saved_report_id']
+        report_data = dict(st.session_state['report_data'])
+        submitted_at = datetime.now().isoformat(timespec='seconds')
+
+        # 更新报告状态、记录船位及所在区域，在同一事务中完成；
+        # 船舶、报告类型和内容一并按当前选择写入，与自动保存的草稿保持一致
+        # 船位按报告行实际归属的船舶记录，与 backfill_positions 回填的口径相同
+        def submit(cur):
+            row = cur.execute(
+                'UPDATE reports SET status = ?, submitted_at = ?, ship_id = ?, report_type = ?, data = ? WHERE id = ? RETURNING ship_id', 
+                ('submitted', submitted_at, ship_id, report_type, str(report_data), report_id)
+            ).fetchone()
+            if row is None:
+                return
+            record_position(cur, report_id, row[0], report_data, submitted_at)
+            tag_report(cur, zone_index, report_id, report_data)
+
+        writer.transaction(submit).result()
         st.success('报告提交成功！')
 
         # 发送邮件
@@ -381,8 +628,9 @@ def fill_report():
         else:
             st.error('请填写收件人邮箱地址')
 
-        # 清空保存状态
+        # 清空保存状态；下次填报以刚提交的报告作为上一份报告
         del st.session_state['saved_report_id']
+        st.session_state.pop('report_context', None)
 
 
 # 发送邮件
@@ -399,52 +647,157 @@ def send_email(subject, message_text, to_email):
     # 添加邮件正文
     msg.attach(MIMEText(message_text, 'plain'))
 
-    # 连接到 SMTP 服务器并发送邮件
-    server = smtplib.SMTP_SSL('smtp.163.com', 465)  # 使用 SSL
-    server.login(sender_email, sender_password)
+    # 连接到 SMTP 服务器并发送邮件（压测时可通过环境变量指向本地 SMTP 接收端）
+    smtp_host = os.environ.get('SHIPTALK_SMTP_HOST', 'smtp.163.com')
+    smtp_port = int(os.environ.get('SHIPTALK_SMTP_PORT', 465))
+    if os.environ.get('SHIPTALK_SMTP_SSL', '1') == '1':
+        server = smtplib.SMTP_SSL(smtp_host, smtp_port)  # 使用 SSL
+    else:
+        server = smtplib.SMTP(smtp_host, smtp_port)
+    sender_password = os.environ.get('SHIPTALK_SMTP_PASSWORD', sender_password)
+    if sender_password:
+        server.login(sender_email, sender_password)
     server.send_message(msg)
     server.quit()      
 
 
-def view_reports():
-    st.subheader('报告查阅')
+# 船舶航迹，从船位表按时间段读取并抽稀到最多 500 个点
+def show_track(ship_id):
+    today = datetime.now().date()
+    period = st.date_input('航迹时间段', (today.replace(year=today.year - 1), today))
+    if len(period) != 2:
+        return
+    track = load_track(
+        c, ship_id, period[0].isoformat(), period[1].isoformat() + 'T23:59:59', max_points=500
+    )
+    if not track:
+        st.info('该时间段内没有船位记录。')
+        return
+    points = pd.DataFrame(track, columns=['时间', 'lat', 'lon'])
+    st.pydeck_chart(pdk.Deck(
+        initial_view_state=pdk.data_utils.compute_view(points[['lon', 'lat']]),
+        layers=[
+            pdk.Layer('PathLayer', [{'path': points[['lon', 'lat']].values.tolist()}],
+                      get_path='path', get_color=[0, 90, 180], width_min_pixels=2),
+            pdk.Layer('ScatterplotLayer', points, get_position=['lon', 'lat'],
+                      get_fill_color=[230, 80, 0], radius_min_pixels=3, pickable=True),
+        ],
+        tooltip={'text': '{时间}'},
+    ))
+
+
+# 本会话已加载的已提交报告，首次打开时读取一次，之后只按变更日志增量更新
+def sync_report_feed():
+    company_id = st.session_state['company_id']
+    feed = st.session_state.get('report_feed')
+    if feed is None or feed['company_id'] != company_id:
+        # 先记下日志序号再读取报告，两者之间的变更会在下次增量更新时重放
+        seq = latest_seq(c, company_id)
+        reports = c.execute(
+            '''
+            SELECT reports.id, reports.ship_id, ships.ship_name, reports.report_type, reports.data
+            FROM reports
+            JOIN ships ON reports.ship_id = ships.id
+            WHERE reports.status = ? AND ships.company_id = ?
+            ORDER BY reports.id
+            ''',
+            ('submitted', company_id)
+        ).fetchall()
+        feed = {'company_id': company_id, 'seq': seq, 'reports': {row[0]: row for row in reports}}
+        st.session_state['report_feed'] = feed
+        return []
+
+    events = []
+    while True:
+        batch = read_events(c, company_id, feed['seq'], limit=500)
+        if batch:
+            apply_events(feed['reports'], batch)
+            feed['seq'] = batch[-1]['seq']
+            events += batch
+        if len(batch) < 500:
+            return events
+
+
+def report_frame():
+    report_df = pd.DataFrame(
+        list(st.session_state['report_feed']['reports'].values()),
+        columns=['ID', '船舶ID', '船舶名称', '报告类型', '数据']
+    )
+    report_df['状态'] = 'submitted'
+    # 按报告 ID 倒序排序
+    return report_df.sort_values(by='ID', ascending=False)
 
-    # 查询所有报告，并获取船舶名称
-    reports = c.execute(
-        '''
-        SELECT reports.id, reports.ship_id, ships.ship_name, reports.report_type, reports.data, reports.status
-        FROM reports
-        JOIN ships ON reports.ship_id = ships.id
-        WHERE reports.status = ?
-        ''',
-        ('submitted',)
-    ).fetchall()
 
-    # 将查询结果转为 DataFrame
-    report_df = pd.DataFrame(reports, columns=['ID', '船舶ID', '船舶名称', '报告类型', '数据', '状态'])
+def view_reports():
+    st.subheader('报告查阅')
 
-    # 按报告 ID 倒序排序
-    report_df = report_df.sort_values(by='ID', ascending=False)
+    sync_report_feed()
+    report_df = report_frame()
 
     # 添加选项“全部”作为默认选项
     ship_names = ['全部'] + report_df['船舶名称'].unique().tolist()
 
     # 创建选择框，用于选择船舶
-    selected_ship_name = st.selectbox('选择查看的船舶名称', ship_names)
+    selected_ship_name = st.selectbox('选择查看的船舶名称', ship_names, on_change=reset_report_list)
+
+    if selected_ship_name != '全部':
+        show_track(int(report_df[report_df['船舶名称'] == selected_ship_name]['船舶ID'].iloc[0]))
+
+    # 批量重扫本公司全部历史报告中的油耗、航速异常
+    if st.button('异常数据检查'):
+        scan = rescan_fleet(conn, st.session_state['company_id'])
+        flagged = scan[scan['anomaly']].merge(report_df[['ID', '船舶名称', '报告类型']], left_on='id', right_on='ID')
+        if flagged.empty:
+            st.success('未发现异常数据。')
+        else:
+            st.warning(f'发现 {len(flagged)} 份报告的油耗或航速数据异常。')
+            st.dataframe(flagged[['ID', '船舶名称', '报告类型', 'fuel', 'speed']].rename(
+                columns={'fuel': '24小时耗油量', 'speed': '平均航速'}
+            ), hide_index=True)
+
+    report_list(selected_ship_name)
+
+# 报告列表每页显示的份数，点击“加载更多”再追加一页
+REPORT_PAGE_SIZE = 20
 
-    # 根据选择的船舶名称筛选报告，默认显示全部
-    if selected_ship_name == '全部':
-        filtered_report_df = report_df
-    else:
-        filtered_report_df = report_df[report_df['船舶名称'] == selected_ship_name]
+
+def show_more_reports():
+    st.session_state['report_list_limit'] = st.session_state.get('report_list_limit', REPORT_PAGE_SIZE) + REPORT_PAGE_SIZE
+
+
+# 切换查看的船舶时回到第一页
+def reset_report_list():
+    st.session_state.pop('report_list_limit', None)
+
+
+# 报告列表每 5 秒自动刷新，只读取变更日志中的新事件，不重新查询全部报告；
+# 只渲染最新的若干份报告，不再为全部历史报告重建 DataFrame 和展开框
+@st.fragment(run_every=5)
+def report_list(selected_ship_name):
+    for event in sync_report_feed():
+        if event['event'] == 'submitted':
+            st.toast(f"新报告：{event['ship_name']} - {event['report_type']}")
+    limit = st.session_state.get('report_list_limit', REPORT_PAGE_SIZE)
+
+    # 报告集合按报告 ID 顺序建立、新报告追加在末尾，倒序遍历即最新的在前；
+    # 根据选择的船舶名称筛选报告，默认显示全部，多取一份用于判断是否还有更多
+    rows = []
+    for row in reversed(st.session_state['report_feed']['reports'].values()):
+        if selected_ship_name == '全部' or row[2] == selected_ship_name:
+            rows.append(row)
+            if len(rows) > limit:
+                break
 
     # 显示筛选后的报告列表
-    for _, row in filtered_report_df.iterrows():
-        with st.expander(f"报告 ID: {row['ID']} - {row['报告类型']}"):
-            st.write(f"**船舶名称:** {row['船舶名称']}")
-            st.write(f"**状态:** {row['状态']}")
+    for report_id, _, ship_name, report_type, data in rows[:limit]:
+        with st.expander(f"报告 ID: {report_id} - {report_type}"):
+            st.write(f"**船舶名称:** {ship_name}")
+            st.write(f"**状态:** submitted")
             st.write(f"**数据:**")
-            st.text_area(f"详细内容 (报告 ID: {row['ID']})", row['数据'], height=200)
+            st.text_area(f"详细内容 (报告 ID: {report_id})", data, height=200)
+
+    if len(rows) > limit:
+        st.button('加载更多', on_click=show_more_reports)
 
 # Streamlit主界面逻辑
 # Streamlit主界面逻辑
@@ -465,9 +818,18 @@ def main():
 
     if 'logged_in' not in st.session_state:
         st.session_state['logged_in'] = False
+    restore_session()
      
     
-    if st.session_state['logged_in']:
+    if st.session_state.get('admin_logged_in', False):
+        admin_overview()
+
+        if st.sidebar.button('退出登录'):
+            st.session_state['admin_logged_in'] = False
+            forget_session()
+            st.rerun()
+
+    elif st.session_state['logged_in']:
         #st.sidebar.header('船舶报告系统')
         page = st.sidebar.radio('🚢选择功能', ['船舶配置', '模板配置', '报告填报', '报告查阅'])
      
@@ -483,15 +845,18 @@ def main():
         if st.sidebar.button('退出登录'):
             st.session_state['logged_in'] = False
             st.session_state.pop('company_id', None)    
+            forget_session()
 
     else:
         st.sidebar.header('账号管理')
-        action = st.sidebar.radio('选择操作', ['登录', '注册'])
+        action = st.sidebar.radio('选择操作', ['登录', '注册', '管理员登录'])
 
         if action == '登录':
             login()
         elif action == '注册':
             register_company()  
+        elif action == '管理员登录':
+            login_admin()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,57 @@
+import ast
+
+import numpy as np
+import pandas as pd
+
+from anomaly import FUEL_FIELD, SPEED_FIELD, ShipStats, parse_number, rescan
+
+
+# 两艘船的历史报告，数值围绕各自的常态波动，穿插少量明显异常的数值
+def make_reports(count=200, seed=3):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(count):
+        ship_id = 1 + i % 2
+        speed = rng.normal(12 + 2 * ship_id, 0.4)
+        fuel = 0.012 * speed ** 3 * rng.normal(1, 0.03)
+        if rng.random() < 0.08:
+            fuel *= rng.choice([0.3, 2.5])
+        if rng.random() < 0.03:
+            speed = 45.0
+        data = {'航次编号': 'V01', FUEL_FIELD: f'{fuel:.2f}吨', SPEED_FIELD: f'{speed:.1f}节'}
+        rows.append({'id': i + 1, 'ship_id': ship_id, 'data': str(data)})
+    return pd.DataFrame(rows)
+
+
+def test_parse_number():
+    assert parse_number('12.5节') == 12.5
+    assert parse_number('约 -3 吨') == -3.0
+    assert parse_number('') is None
+    assert parse_number(None) is None
+
+
+# 批量重扫与提交时的在线评分（先评分再计入窗口）标记的报告一致
+def test_rescan_matches_online_scoring():
+    reports = make_reports()
+    stats = {}
+    online = set()
+    for row in reports.itertuples():
+        ship = stats.setdefault(row.ship_id, ShipStats())
+        data = ast.literal_eval(row.data)
+        if ship.score(data):
+            online.add(row.id)
+        ship.observe(data)
+
+    result = rescan(reports)
+    flagged = set(result.loc[result['anomaly'], 'id'])
+    assert online
+    assert flagged == online
+
+
+def test_short_history_only_checks_bounds():
+    stats = ShipStats()
+    for speed in (12.0, 12.5, 13.0):
+        stats.observe({FUEL_FIELD: '25', SPEED_FIELD: str(speed)})
+    assert stats.score({FUEL_FIELD: '80', SPEED_FIELD: '12'}) == []
+    assert len(stats.score({FUEL_FIELD: '400', SPEED_FIELD: '12'})) == 1
+    assert len(stats.score({FUEL_FIELD: '二十', SPEED_FIELD: '12'})) == 1
@@ -0,0 +1,60 @@
+import io
+
+import pandas as pd
+import pytest
+
+from fleet_import import read_fleet_file, imo_valid, mmsi_valid, validate_fleet
+
+
+def test_imo_valid():
+    imo = pd.Series(['9074729', '9074728', '1234567', '907472', '90747290', 'IMO9074729', ''])
+    assert imo_valid(imo).tolist() == [True, False, True, False, False, False, False]
+
+
+def test_mmsi_valid():
+    mmsi = pd.Series(['412345678', '201000000', '775999999', '200999999', '776000000', '41234567', '41234567a', ''])
+    assert mmsi_valid(mmsi).tolist() == [True, True, True, False, False, False, False, False]
+
+
+def test_validators_on_empty_input():
+    assert imo_valid(pd.Series([], dtype=str)).tolist() == []
+    assert mmsi_valid(pd.Series([], dtype=str)).tolist() == []
+
+
+CSV = 'Vessel Name,IMO,MMSI\n 海洋3号 ,imo 9074729,412 345 678\n,,\n'
+
+
+# UTF-8（含 BOM）以及中文版 Excel 另存的 GBK 编码 CSV 都能读取，英文表头、IMO 前缀和空格被规范化
+@pytest.mark.parametrize('encoding', ['utf-8', 'utf-8-sig', 'gbk'])
+def test_read_csv_encodings(encoding):
+    csv = CSV.replace('Vessel Name', 'vessel_name')
+    fleet = read_fleet_file(io.BytesIO(csv.encode(encoding)), 'fleet.csv')
+    assert fleet.values.tolist() == [['海洋3号', '9074729', '412345678']]
+
+
+# 全角数字在读取时转为半角，未经转换的全角数字不能通过校验
+def test_full_width_digits_are_normalized():
+    csv = '船舶名称,IMO编号,MMSI\n海洋3号,ＩＭＯ９０７４７２９,４１２３４５６７８\n'
+    fleet = read_fleet_file(io.BytesIO(csv.encode('gbk')), 'fleet.csv')
+    assert fleet.values.tolist() == [['海洋3号', '9074729', '412345678']]
+    assert not imo_valid(pd.Series(['９０７４７２９']))[0]
+    assert not mmsi_valid(pd.Series(['４１２３４５６７８']))[0]
+
+
+def test_read_rejects_missing_columns_and_corrupt_xlsx():
+    with pytest.raises(ValueError, match='缺少列'):
+        read_fleet_file(io.BytesIO(CSV.encode()), 'fleet.csv')
+    with pytest.raises(ValueError, match='Excel'):
+        read_fleet_file(io.BytesIO(b'PK\x03\x04 not really a zip'), 'fleet.xlsx')
+
+
+def test_validate_fleet_flags_duplicates():
+    fleet = pd.DataFrame({
+        '船舶名称': ['海洋3号', '海洋4号', '海洋5号'],
+        'IMO编号': ['9074729', '9074729', '1234567'],
+        'MMSI': ['412345678', '112345678', '412345679'],
+    })
+    errors = validate_fleet(fleet, [('海洋1号', '1234567', '412000001')])
+    assert errors[0] == ['IMO编号在文件中重复']
+    assert sorted(errors[1]) == sorted(['MMSI无效（应为9位数字，前3位为201~775）', 'IMO编号在文件中重复'])
+    assert errors[2] == ['IMO编号与已有船舶重复']
@@ -0,0 +1,78 @@
+import sqlite3
+
+import pytest
+
+from report_formulas import FormulaEngine, field_names, previous_values
+
+TEMPLATE = (
+    '剩余燃油天数=船舶燃油存量/24小时耗油量,航次编号=上次.航次编号,24小时耗油量,'
+    '船舶燃油存量=上次.船舶燃油存量-24小时耗油量,船舶位置'
+)
+
+
+def test_field_names_drop_formulas():
+    assert field_names(TEMPLATE) == ['剩余燃油天数', '航次编号', '24小时耗油量', '船舶燃油存量', '船舶位置']
+
+
+@pytest.mark.parametrize('template, message', [
+    ('a=b,b=c,c=a,d', '循环引用'),
+    ('a=a+1', '循环引用'),
+    ('a=b*2,c', '不存在的字段'),
+    ('a=(c+1,c', '公式'),
+])
+def test_invalid_templates(template, message):
+    with pytest.raises(ValueError, match=message):
+        FormulaEngine(template)
+
+
+# 派生字段排在它依赖的字段之后，模板中的书写顺序不影响计算
+def test_dependency_order():
+    engine = FormulaEngine(TEMPLATE)
+    order = engine.order
+    assert order.index('24小时耗油量') < order.index('船舶燃油存量') < order.index('剩余燃油天数')
+    assert engine.affected['24小时耗油量'] == ['船舶燃油存量', '剩余燃油天数']
+    assert engine.affected['船舶位置'] == []
+    assert engine.previous_refs == {'航次编号': ['航次编号'], '船舶燃油存量': ['船舶燃油存量']}
+
+
+def test_compute_and_update():
+    engine = FormulaEngine(TEMPLATE)
+    previous = {'航次编号': 'V01', '船舶燃油存量': '500吨'}
+    data = {'24小时耗油量': '20'}
+    assert engine.compute_all(data, previous) == {'剩余燃油天数': '24', '航次编号': 'V01', '船舶燃油存量': '480'}
+
+    data['24小时耗油量'] = '25'
+    assert engine.update(data, previous, '24小时耗油量') == {'船舶燃油存量': '475', '剩余燃油天数': '19'}
+    # 与派生字段无关的字段修改不触发重算
+    assert engine.update(data, previous, '船舶位置') == {}
+
+
+# 手动改写过的派生字段不被覆盖，依赖它的字段按改写后的值计算
+def test_manual_fields_are_kept():
+    engine = FormulaEngine(TEMPLATE)
+    data = {'24小时耗油量': '20', '船舶燃油存量': '400'}
+    engine.compute_all(data, {'船舶燃油存量': '500'}, manual={'船舶燃油存量'})
+    assert data['船舶燃油存量'] == '400'
+    assert data['剩余燃油天数'] == '20'
+
+
+def test_missing_previous_leaves_fields_blank():
+    engine = FormulaEngine(TEMPLATE)
+    data = {'24小时耗油量': '20'}
+    engine.compute_all(data, {})
+    assert data['船舶燃油存量'] == '' and data['剩余燃油天数'] == ''
+    assert engine.missing_previous({'航次编号': 'V01'}) == {'船舶燃油存量': ['船舶燃油存量']}
+
+
+# 只取紧邻的上一份已提交报告，其中为空的字段视为缺失，不向更早的报告回溯
+def test_previous_values_uses_latest_submitted_report():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE reports (id INTEGER PRIMARY KEY, ship_id INTEGER, data TEXT, status TEXT)')
+    conn.executemany('INSERT INTO reports (ship_id, data, status) VALUES (?, ?, ?)', [
+        (1, str({'航次编号': 'V01', '船舶燃油存量': '500'}), 'submitted'),
+        (1, str({'航次编号': 'V02', '船舶燃油存量': ' '}), 'submitted'),
+        (1, str({'航次编号': 'V03', '船舶燃油存量': '300'}), 'saved'),
+        (2, str({'航次编号': 'X01'}), 'submitted'),
+    ])
+    assert previous_values(conn, 1) == {'航次编号': 'V02'}
+    assert previous_values(conn, 3) == {}
@@ -0,0 +1,109 @@
+import random
+import sqlite3
+import threading
+import uuid
+import zlib
+
+import pytest
+
+from api_server import APIServer
+from schema import init_db
+from ship_sync import (
+    MAGIC, VERSION, encode_batch, decode_batch, apply_batch, fields_checksum, Outbox, SyncClient,
+)
+from report_formulas import field_names
+
+FIELDS = '航次编号,填报日期,船舶位置,24小时耗油量'
+
+
+def make_report(ship_id=1, template_id=1, values=('V01', '2024-09-06', '12.5N 120.3E', '28.5')):
+    return {
+        'key': uuid.uuid4().bytes, 'ship_id': ship_id, 'template_id': template_id,
+        'created_at': 1725580800, 'checksum': fields_checksum(field_names(FIELDS)), 'values': list(values),
+    }
+
+
+# 建一个只有一家公司、一艘船、一个模板的数据库
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'sync.db')
+    conn = sqlite3.connect(path)
+    init_db(conn.cursor())
+    conn.execute("INSERT INTO companies (id, company_name, password) VALUES (1, '测试航运', x'00')")
+    conn.execute("INSERT INTO ships (id, company_id, ship_name) VALUES (1, 1, '海洋1号')")
+    conn.execute("INSERT INTO report_templates (id, company_id, report_type, fields) VALUES (1, 1, '午报', ?)", (FIELDS,))
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_batch_round_trip():
+    reports = [make_report(), make_report(ship_id=300, values=('', '多字节：船位 ✓', '', '1' * 5000))]
+    assert decode_batch(encode_batch(reports)) == reports
+
+
+def test_empty_batch_round_trip():
+    assert decode_batch(encode_batch([])) == []
+
+
+# 截断、篡改、解压后超限等格式错误统一抛出 ValueError
+def test_truncated_batch_rejected():
+    payload = encode_batch([make_report(), make_report()])
+    for end in range(len(payload)):
+        with pytest.raises(ValueError):
+            decode_batch(payload[:end])
+
+
+def test_corrupt_batch_rejected():
+    payload = bytearray(encode_batch([make_report()]))
+    payload[len(payload) // 2] ^= 0xFF
+    with pytest.raises(ValueError):
+        decode_batch(bytes(payload))
+    with pytest.raises(ValueError):
+        decode_batch(b'XX' + bytes(payload[2:]))
+
+
+def test_truncated_body_rejected():
+    body = bytearray(zlib.decompress(encode_batch([make_report()])[3:]))
+    for end in (1, 10, len(body) - 1):
+        with pytest.raises(ValueError):
+            decode_batch(MAGIC + bytes([VERSION]) + zlib.compress(bytes(body[:end])))
+
+
+def test_oversized_body_rejected(monkeypatch):
+    import ship_sync
+    monkeypatch.setattr(ship_sync, 'MAX_BODY_SIZE', 1024)
+    with pytest.raises(ValueError):
+        decode_batch(encode_batch([make_report(values=('x' * 4096, '', '', ''))]))
+
+
+def test_apply_batch_is_idempotent(db_path):
+    conn = sqlite3.connect(db_path)
+    reports = [make_report(), make_report()]
+    assert apply_batch(conn.cursor(), 1, reports) == (2, 0)
+    assert apply_batch(conn.cursor(), 1, reports + [make_report()]) == (1, 2)
+    assert conn.execute('SELECT COUNT(*) FROM reports').fetchone()[0] == 3
+    assert conn.execute('SELECT COUNT(*) FROM ship_positions').fetchone()[0] == 3
+
+
+# 模拟丢包（请求或确认丢失）时客户端重传，岸端按幂等键去重，每份报告只入库一次
+def test_push_with_packet_loss(db_path, tmp_path):
+    random.seed(7)
+    server = APIServer(('127.0.0.1', 0), db_path, drop_rate=0.4)
+    server.authenticate = lambda header: 1
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        outbox = Outbox(str(tmp_path / 'outbox.db'))
+        client = SyncClient(f'http://127.0.0.1:{server.server_address[1]}', '测试航运', 'x', timeout=5)
+        outbox.store_reference(client.fetch_reference())
+        keys = [outbox.queue_report(1, 1, {'航次编号': f'V{i:02d}', '24小时耗油量': str(20 + i)}) for i in range(30)]
+        assert client.push(outbox, batch_size=4, max_retries=50, backoff=0) == 30
+        assert outbox.pending(100) == []
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    conn = sqlite3.connect(db_path)
+    stored = conn.execute('SELECT idempotency_key FROM reports ORDER BY id').fetchall()
+    assert sorted(key for (key,) in stored) == sorted(str(uuid.UUID(bytes=key)) for key in keys)
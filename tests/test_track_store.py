@@ -0,0 +1,77 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from schema import init_db
+from track_store import parse_position, simplify, record_position, load_track
+
+
+# 一段弯曲的航迹，叠加小幅噪声
+def make_track(n=2000, seed=5):
+    rng = np.random.default_rng(seed)
+    t = np.linspace(0, 6 * np.pi, n)
+    lat = 20 + 3 * np.sin(t) + rng.normal(0, 0.01, n)
+    lon = 110 + t + rng.normal(0, 0.01, n)
+    return lat, lon
+
+
+def test_parse_position():
+    assert parse_position('12.5N 120.3E') == (12.5, 120.3)
+    assert parse_position("12°30'S, 120°18'W") == (-12.5, -120.3)
+    assert parse_position('95N 120E') is None
+    assert parse_position('') is None
+
+
+@pytest.mark.parametrize('max_points', [2, 3, 10, 100, 1999])
+def test_simplify_respects_point_budget(max_points):
+    lat, lon = make_track()
+    keep = simplify(lat, lon, max_points=max_points)
+    assert len(keep) == max_points
+    assert keep[0] == 0 and keep[-1] == len(lat) - 1
+    assert np.all(np.diff(keep) > 0)
+
+
+# 点数预算是按误差排序的前缀：预算越大，保留的点集合越大且包含较小预算的结果
+def test_simplify_budgets_are_nested():
+    lat, lon = make_track()
+    previous = set()
+    for max_points in (5, 20, 80, 320):
+        keep = set(simplify(lat, lon, max_points=max_points))
+        assert previous <= keep
+        previous = keep
+
+
+def test_simplify_tolerance_and_budget():
+    lat, lon = make_track()
+    by_tolerance = simplify(lat, lon, tolerance=0.05)
+    assert 2 < len(by_tolerance) < len(lat)
+    both = simplify(lat, lon, tolerance=0.05, max_points=10)
+    assert len(both) == 10
+    assert set(both) <= set(by_tolerance)
+
+
+def test_simplify_small_inputs():
+    assert list(simplify([1.0], [2.0], max_points=1)) == [0]
+    assert list(simplify([1.0, 2.0, 3.0], [1.0, 2.0, 3.0], max_points=5)) == [0, 1, 2]
+    # 直线上的中间点误差为零，按容差抽稀只保留首尾
+    assert list(simplify(np.zeros(50), np.linspace(100, 110, 50), tolerance=1e-9)) == [0, 49]
+
+
+# 跨越 180° 经线的直线航迹不应因经度跳变而保留中间点
+def test_simplify_across_antimeridian():
+    lon = np.linspace(175, 185, 41)
+    lon = np.where(lon > 180, lon - 360, lon)
+    assert list(simplify(np.full(41, 30.0), lon, tolerance=1e-6)) == [0, 40]
+
+
+# 同一时刻的两份报告各自保留船位
+def test_record_position_keeps_reports_with_same_time(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'track.db'))
+    init_db(conn.cursor())
+    ts = '2024-09-06T12:00:00'
+    assert record_position(conn, 1, 7, {'船舶位置': '12.5N 120.3E'}, ts)
+    assert record_position(conn, 2, 7, {'船舶位置': '12.6N 120.4E'}, ts)
+    assert not record_position(conn, 3, 7, {'船舶位置': '未知'}, ts)
+    assert len(load_track(conn, 7)) == 2
+    assert len(load_track(conn, 7, max_points=2)) == 2
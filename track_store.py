@@ -0,0 +1,189 @@
+import re
+import ast
+
+import numpy as np
+
+# 船舶航迹存储
+# 船位从报告的「船舶位置」字段解析后写入 ship_positions，表以 (ship_id, ts, report_id) 为主键且不带 rowid，
+# 同一艘船的船位在磁盘上按时间连续存放，按时间段查询只需一次主键范围扫描；
+# 主键包含报告ID，同一时刻的多份报告（如离线同步的一批报告）各自保留船位。
+# 读取时按缩放级别（容差）或点数预算用 Douglas–Peucker 算法抽稀，多年航迹也只返回几百个点。
+POSITION_FIELD = '船舶位置'
+
+# 支持 "12.5N 120.3E"、"12°30.5'N, 120°18'E"、"12 30N / 120 18E" 等写法
+_COORD = r"(?P<{0}>\d{{1,3}}(?:\.\d+)?)\s*°?\s*(?:(?P<{0}_min>\d{{1,2}}(?:\.\d+)?)\s*['′]?)?\s*"
+_POSITION = re.compile(
+    _COORD.format('lat') + r'(?P<ns>[NnSs])[\s,，/;]*' + _COORD.format('lon') + r'(?P<ew>[EeWw])'
+)
+# 填报日期，支持 "20240906"、"2024-09-06"、"2024/09/06" 等写法
+_DATE = re.compile(r'(\d{4})[-/.]?(\d{1,2})[-/.]?(\d{1,2})')
+
+
+def _degrees(value, minutes, hemisphere):
+    degrees = float(value) + (float(minutes) / 60 if minutes else 0.0)
+    return -degrees if hemisphere.upper() in ('S', 'W') else degrees
+
+
+# 解析船位文本，返回 (纬度, 经度)，无法解析或超出范围时返回 None
+def parse_position(text):
+    match = _POSITION.search(str(text or ''))
+    if not match:
+        return None
+    lat = _degrees(match['lat'], match['lat_min'], match['ns'])
+    lon = _degrees(match['lon'], match['lon_min'], match['ew'])
+    if abs(lat) > 90 or abs(lon) > 180:
+        return None
+    return lat, lon
+
+
+# 在写线程的事务中记录一份报告的船位，ts 为报告时间（ISO 格式）
+def record_position(c, report_id, ship_id, data, ts):
+    position = parse_position(data.get(POSITION_FIELD))
+    if position is None or not ts:
+        return False
+    c.execute(
+        'INSERT INTO ship_positions (ship_id, ts, lat, lon, report_id) VALUES (?, ?, ?, ?, ?)',
+        (ship_id, ts, position[0], position[1], report_id)
+    )
+    return True
+
+
+# 解析填报日期，返回当日零点的 ISO 时间，无法解析时返回 None
+def _report_date(text):
+    match = _DATE.fullmatch(str(text or '').strip())
+    if not match:
+        return None
+    year, month, day = (int(part) for part in match.groups())
+    if not (1 <= month <= 12 and 1 <= day <= 31):
+        return None
+    return f'{year:04d}-{month:02d}-{day:02d}T00:00:00'
+
+
+# 从历史报告回填船位，建表时执行一次
+# 报告时间：离线同步的报告取船端创建时间，其余取提交时间，旧数据退回到填报日期
+# 报告内容按 str(dict) 保存，逐份用 ast.literal_eval 解析（含单引号的值以双引号保存，不能用正则匹配）
+def backfill_positions(c, chunk_size=50000):
+    last_id = 0
+    filled = 0
+    while True:
+        rows = c.execute('''
+            SELECT id, ship_id, data,
+                   CASE WHEN idempotency_key IS NOT NULL THEN COALESCE(created_at, submitted_at)
+                        ELSE COALESCE(submitted_at, created_at) END
+            FROM reports WHERE status = 'submitted' AND id > ? ORDER BY id LIMIT ?
+        ''', (last_id, chunk_size)).fetchall()
+        if not rows:
+            return filled
+        last_id = rows[-1][0]
+        positions = []
+        for report_id, ship_id, data, ts in rows:
+            try:
+                report = ast.literal_eval(data)
+            except (ValueError, SyntaxError):
+                continue
+            if not isinstance(report, dict):
+                continue
+            position = parse_position(report.get(POSITION_FIELD))
+            if ts is None:
+                ts = _report_date(report.get('填报日期'))
+            if position is not None and ts is not None:
+                positions.append((ship_id, ts, position[0], position[1], report_id))
+        c.executemany(
+            'INSERT INTO ship_positions (ship_id, ts, lat, lon, report_id) VALUES (?, ?, ?, ?, ?)',
+            positions
+        )
+        filled += len(positions)
+
+
+# 各点到所在线段的距离（向量化，平面近似），start、end 为每个点对应线段的端点
+def _segment_distances(points, start, end):
+    segment = end - start
+    offsets = points - start
+    length2 = np.einsum('ij,ij->i', segment, segment)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(length2 > 0, np.einsum('ij,ij->i', offsets, segment) / length2, 0.0)
+    nearest = start + np.clip(t, 0, 1)[:, None] * segment
+    return np.hypot(points[:, 0] - nearest[:, 0], points[:, 1] - nearest[:, 1])
+
+
+# Douglas–Peucker 分解：计算每个点被选中时的误差（重要度），首尾两点为无穷大
+# 逐层向量化：每一轮同时拆分所有线段，取各线段内距离最大的点；轮数等于分解树的深度。
+# 子节点的重要度截取为不超过父节点，因此按重要度取前 k 个点得到的总是一棵完整的分解子树；
+# 误差不超过 tolerance（或排不进前 max_points）的线段不再拆分，其余点的重要度记为 0
+def _importance(points, tolerance=0.0, max_points=None):
+    n = len(points)
+    importance = np.zeros(n)
+    importance[[0, n - 1]] = np.inf
+    kept = np.zeros(n, dtype=bool)
+    kept[[0, n - 1]] = True
+    remaining = np.arange(1, n - 1)
+    while len(remaining):
+        kept_index = np.flatnonzero(kept)
+        segment = np.searchsorted(kept_index, remaining) - 1
+        first, last = kept_index[segment], kept_index[segment + 1]
+        distances = _segment_distances(points[remaining], points[first], points[last])
+
+        # 每条线段内距离最大的点（remaining 有序，同一线段的点相邻）
+        bounds = np.flatnonzero(np.diff(segment, prepend=-1))
+        largest = np.maximum.reduceat(distances, bounds)
+        is_largest = distances == np.repeat(largest, np.diff(np.append(bounds, len(segment))))
+        _, pick = np.unique(segment[is_largest], return_index=True)
+        pick = np.flatnonzero(is_largest)[pick]
+
+        chosen = remaining[pick]
+        importance[chosen] = np.minimum(distances[pick], np.minimum(importance[first[pick]], importance[last[pick]]))
+        kept[chosen] = True
+
+        # 已选出的点超过点数预算时，把容差提高到第 max_points 大的重要度，更小的分支不必再拆分
+        if max_points is not None and kept.sum() > max_points:
+            tolerance = max(tolerance, np.partition(importance[kept], -max_points)[-max_points])
+
+        # 误差已在容差内的线段停止拆分（其子节点的重要度不会更大）
+        split = importance[chosen] > tolerance
+        keep_going = np.repeat(split, np.diff(np.append(bounds, len(segment))))
+        importance[chosen[~split]] = 0
+        kept[chosen[~split]] = False
+        keep_going[pick] = False
+        remaining = remaining[keep_going]
+    return importance
+
+
+# Douglas–Peucker 抽稀，返回保留点的下标
+# 保留误差大于 tolerance 的点；指定 max_points 时再按误差从大到小最多保留该数量的点，
+# 因此既可按容差（缩放级别）也可按点数预算抽稀
+def simplify(lat, lon, tolerance=0.0, max_points=None):
+    n = len(lat)
+    if n <= 2 or (max_points is not None and max_points >= n and tolerance <= 0):
+        return np.arange(n)
+    # 经度展开避免跨越 180° 经线时出现跳变，并按纬度缩放使距离近似等比例
+    lon = np.unwrap(np.asarray(lon, dtype=float), period=360)
+    lat = np.asarray(lat, dtype=float)
+    scale = np.cos(np.radians(np.clip(np.mean(lat), -85, 85)))
+    points = np.column_stack((lon * scale, lat))
+
+    importance = _importance(points, tolerance, max_points)
+    keep = np.flatnonzero(importance > tolerance)
+    if max_points is not None and len(keep) > max_points:
+        cut = len(keep) - max(max_points, 2)
+        keep = np.sort(keep[np.argpartition(importance[keep], cut)[cut:]])
+    return keep
+
+
+# 缩放级别对应的容差：Web 墨卡托瓦片下一个像素对应的度数
+def zoom_tolerance(zoom):
+    return 360.0 / (256 * 2 ** zoom)
+
+
+# 查询某艘船一段时间内的航迹，返回 (时间, 纬度, 经度) 列表
+# 指定 zoom 时按该缩放级别下一像素的容差抽稀，指定 max_points 时最多返回该数量的点
+def load_track(c, ship_id, start=None, end=None, zoom=None, max_points=None):
+    rows = c.execute(
+        'SELECT ts, lat, lon FROM ship_positions WHERE ship_id = ? AND ts >= ? AND ts <= ? ORDER BY ts',
+        (ship_id, start or '', end or '9999-12-31T23:59:59')
+    ).fetchall()
+    if not rows or (zoom is None and max_points is None):
+        return rows
+    lat = np.fromiter((row[1] for row in rows), dtype=float, count=len(rows))
+    lon = np.fromiter((row[2] for row in rows), dtype=float, count=len(rows))
+    tolerance = zoom_tolerance(zoom) if zoom is not None else 0.0
+    return [rows[i] for i in simplify(lat, lon, tolerance, max_points)]